@@ -1,27 +1,25 @@
 import psycopg2
 import os
 import logging
+import time
+import pandas as pd
 
-from configparser import ConfigParser
-from typing import Dict, Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
 
+from modules.aggregates import aggregates_enabled, refresh_aggregates
+from modules.config import parse_ini, parse_option
+from modules.db import get_connection, release_connection
+from modules.dimensions import (create_dimensions, create_views, dimension_cache, dimension_type, encode_dimensions,
+                                normalized)
+from modules.loader import copy_from_df
+from modules.metrics import emit, metrics_enabled
+from modules.partitions import ensure_partitions, partition_clause, partition_key, primary_key
+from modules.preparation import iter_prep_main
+from modules.profiler import check_drift, profile_needed
 
-logging.basicConfig(level=logging.INFO)
-
-
-def parse_ini() -> Union[str, Dict]:
-    """
-    Функция извлечения информации о пути проекта и подключении к БД из конфигурационного файла
-    """
-    # Создание плавающего пути к исполняемому файлу
-    basedir = os.path.dirname(os.path.abspath(__file__))
 
-    parser = ConfigParser()
-    parser.read(os.path.join(basedir, 'ddl.ini'))
-
-    path_info = parser.get('path', 'path')
-    conn_info = {param[0]: param[1] for param in parser.items('postgresql')}
-    return path_info, conn_info
+logging.basicConfig(level=logging.INFO)
 
 
 def create_user(
@@ -101,17 +99,134 @@ def execute_query(
     Функция выполнения SQL запроса
     """
 
-    conn.autocommit = True
     try:
         cur.execute(sql_query)
+        conn.commit()
         logging.info(f" * SUCCESS *: Query \'{sql_query[9:30]}...\' executed.")
     except Exception as e:
         logging.error(f"{type(e).__name__}: {e} ")
-    else:
-        conn.autocommit = False
+        conn.rollback()
+
+
+def check_main_data(
+        cached_only: bool = False
+) -> bool:
+    """
+    Функция проверки основной выгрузки по профилю (cached_only - только файлы с сохраненным профилем, без чтения)
+    """
 
+    path_info, _ = parse_ini()
+    files = [f'{path_info}/data/main_data/ga_{dataset}.csv' for dataset in ('sessions', 'hits')]
+    checks = [check_drift(file) for file in files if not (cached_only and profile_needed(file))]
+    if not all(checks):
+        logging.error("Initial load is cancelled: main data doesn't match the database schema.")
+    return all(checks)
 
-def ddl():
+
+def load_stream(
+        conn: psycopg2.extensions.connection,
+        cur: psycopg2.extensions.cursor
+) -> bool:
+    """
+    Функция потоковой загрузки обработанной основной выгрузки в таблицы через COPY FROM STDIN одной транзакцией
+    (False - выгрузка не соответствует схеме БД, загрузка отменена)
+    """
+
+    rows = {}
+    try:
+        for dataset, df in iter_prep_main():
+            table = f'db_{dataset}'
+            start = time.perf_counter()
+            if partition_key(table) is not None:
+                ensure_partitions(df[partition_key(table)], table, cur)
+            copy_from_df(encode_dimensions(df, table), table, cur)
+            rows[dataset] = rows.get(dataset, 0) + len(df)
+            if metrics_enabled():
+                wall = time.perf_counter() - start
+                emit('load', file=f'ga_{dataset}.csv', table=table, wall_s=round(wall, 4),
+                     rows_per_s=round(len(df) / wall, 1), rows=len(df))
+
+        # Профиль построен в проходе обработки: загрузка фиксируется только при соответствии выгрузки схеме БД
+        if not check_main_data():
+            conn.rollback()
+            return False
+        conn.commit()
+        logging.info(f" * SUCCESS *: Stream rows {rows} to database complete.")
+    except Exception as e:
+        logging.error(f"{type(e).__name__}: {e} ")
+        conn.rollback()
+        # Ошибка обработки или загрузки до окончания прохода (например, строка длиннее VARCHAR):
+        # выгрузка проверяется по полному профилю
+        return check_main_data()
+    return True
+
+
+def initial_load_mode() -> str:
+    """
+    Функция определения режима начальной загрузки (в режиме нормализации значения перекодируются на стороне
+    клиента, поэтому используется только потоковая загрузка)
+    """
+
+    load_mode = parse_option('ddl', 'load_mode', fallback='stream')
+    if load_mode == 'file' and normalized():
+        logging.warning("Load mode 'file' is not supported in normalized mode, 'stream' is used.")
+        return 'stream'
+    return load_mode
+
+
+def prepare_partitions(
+        file_path: str,
+        table: str,
+        conn: psycopg2.extensions.connection,
+        cur: psycopg2.extensions.cursor
+) -> None:
+    """
+    Функция создания секций таблицы по датам подготовленного csv-файла перед серверным импортом
+    """
+
+    key = partition_key(table)
+    if key is None:
+        return
+
+    try:
+        for chunk in pd.read_csv(file_path, usecols=[key], chunksize=1_000_000):
+            ensure_partitions(chunk[key], table, cur)
+        conn.commit()
+    except Exception as e:
+        logging.error(f"{type(e).__name__}: {e} ")
+        conn.rollback()
+
+
+def build_keys(
+        queries: List[str]
+) -> None:
+    """
+    Функция параллельного построения ключей (индексов) после загрузки, каждый запрос в отдельном соединении
+    """
+
+    # Память и число параллельных процессов сервера для построения одного индекса (только в транзакции запроса,
+    # соединение возвращается в пул с исходными настройками), построение не ограничено statement_timeout
+    settings_sql = f'''
+        SET LOCAL maintenance_work_mem = '{parse_option('ddl', 'maintenance_work_mem', fallback='1GB')}';
+        SET LOCAL max_parallel_maintenance_workers = {parse_option('ddl', 'parallel_workers', fallback='4')};
+        SET LOCAL statement_timeout = 0
+    '''
+
+    def build(query: str) -> None:
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute(settings_sql)
+        execute_query(query, conn, cur)
+        cur.close()
+        release_connection(conn)
+
+    with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+        list(executor.map(build, queries))
+
+
+def ddl(
+        create_database: bool = True
+) -> None:
     """
     Главная функция
     """
@@ -120,79 +235,158 @@ def ddl():
     # Считывание данных из конфигурационного файла
     path_info, conn_info = parse_ini()
 
-    # Создание базы данных
-    create_db(conn_info)
+    # Режим загрузки: stream - обработанные части передаются в БД напрямую по соединению клиента,
+    # file - импорт из csv-файлов, подготовленных data_prep (файлы должны быть доступны серверу БД)
+    load_mode = initial_load_mode()
+
+    # Проверка основной выгрузки до создания таблиц по профилю, построенному при обработке (data_prep);
+    # в потоковом режиме профиль без сохраненного строится в проходе загрузки и проверяется перед фиксацией
+    if not check_main_data(cached_only=load_mode == 'stream'):
+        return
 
-    conn = create_connection(conn_info)
+    # Создание базы данных (пропускается, если БД уже создана, например, при замерах производительности)
+    if create_database:
+        create_db(conn_info)
+
+    # Соединение из общего пула (БД создана, пул подключается к ней)
+    conn = get_connection()
     cursor = conn.cursor()
 
+    # Быстрая начальная загрузка: таблицы создаются без ключей, ключи строятся после загрузки
+    fast_load = parse_option('ddl', 'fast_load', fallback='false') == 'true'
+
+    # Секционирование по дате (ключ секционированной таблицы включает колонку секционирования)
+    sessions_key = ', '.join(primary_key('db_sessions'))
+    hits_key = ', '.join(primary_key('db_hits'))
+    sessions_partitioned = partition_key('db_sessions') is not None
+
+    # Режим нормализации: низкокардинальные колонки хранят идентификаторы таблиц-справочников
+    dim_type = dimension_type()
+    if normalized():
+        dimension_cache.reset()
+        create_dimensions(cursor)
+        conn.commit()
+
     # Создание таблицы db_sessions
-    db_sessions_sql = '''
+    db_sessions_sql = f'''
         CREATE TABLE IF NOT EXISTS db_sessions (
-           session_id VARCHAR(50) NOT NULL UNIQUE PRIMARY KEY, 
+           session_id VARCHAR(50) NOT NULL,
            client_id VARCHAR(50) NOT NULL,
-           visit_date DATE,
+           visit_date DATE{' NOT NULL' if sessions_partitioned else ''},
            visit_time TIME NOT NULL,
            visit_number SMALLINT NOT NULL, 
-           utm_source VARCHAR(50) NOT NULL,
-           utm_medium VARCHAR(50) NOT NULL,
-           utm_campaign VARCHAR(50) NOT NULL,
-           utm_adcontent VARCHAR(50) NOT NULL,
-           device_category VARCHAR(50) NOT NULL,
-           device_brand VARCHAR(50) NOT NULL,
-           device_screen_resolution VARCHAR(50) NOT NULL,
-           device_browser VARCHAR(50) NOT NULL,
-           geo_country VARCHAR(50) NOT NULL,
-           geo_city VARCHAR(50) NOT NULL
-            )
+           utm_source {dim_type} NOT NULL,
+           utm_medium {dim_type} NOT NULL,
+           utm_campaign {dim_type} NOT NULL,
+           utm_adcontent {dim_type} NOT NULL,
+           device_category {dim_type} NOT NULL,
+           device_brand {dim_type} NOT NULL,
+           device_screen_resolution {dim_type} NOT NULL,
+           device_browser {dim_type} NOT NULL,
+           geo_country {dim_type} NOT NULL,
+           geo_city {dim_type} NOT NULL{'' if fast_load else f', PRIMARY KEY ({sessions_key})'}
+            ) {partition_clause('db_sessions')}
     '''
 
     execute_query(db_sessions_sql, conn, cursor)
 
     # Создание таблицы db_hits
-    db_hits_sql = '''
+    db_hits_sql = f'''
         CREATE TABLE IF NOT EXISTS db_hits (
             session_id VARCHAR(50) NOT NULL,
             hit_date DATE NOT NULL,
             hit_number SMALLINT NOT NULL,
             hit_page_path TEXT NOT NULL,
-            event_category VARCHAR(50) NOT NULL,
-            event_action VARCHAR(50) NOT NULL,
-            PRIMARY KEY (session_id, hit_number)
-            )            
-            
+            event_category {dim_type} NOT NULL,
+            event_action {dim_type} NOT NULL{'' if fast_load else ','}
+            {'' if fast_load else f'PRIMARY KEY ({hits_key})'}
+            ) {partition_clause('db_hits')}
     '''
 
     execute_query(db_hits_sql, conn, cursor)
 
-    # Импорт обработанных данных из csv в таблицу db_sessions
     path_to_sessions = f'{path_info}/data/prep_data/ga_sessions_prep.csv'
-    ga_sessions_prep_sql = f'''
-        COPY db_sessions FROM '{path_to_sessions}' HEADER CSV
-    '''
-    execute_query(ga_sessions_prep_sql, conn, cursor)
-
-    # Импорт обработанных данных из csv в таблицу db_hits
     path_to_hits = f'{path_info}/data/prep_data/ga_hits_prep.csv'
-    ga_hits_prep_sql = f'''
-        COPY db_hits FROM '{path_to_hits}' HEADER CSV
-    '''
-    execute_query(ga_hits_prep_sql, conn, cursor)
 
-    # Удаление строк в таблице db_hits с значениями session_id, которых нет в таблице db_sessions
-    db_delete_absent_sql = f'''
-        DELETE FROM db_hits h WHERE NOT EXISTS (SELECT 1 FROM db_sessions s WHERE h.session_id = s.session_id)
-    '''
-    execute_query(db_delete_absent_sql, conn, cursor)
+    if load_mode == 'stream':
+        if not load_stream(conn, cursor):
+            cursor.close()
+            release_connection(conn)
+            return
+    else:
+        # Создание секций по датам в подготовленных файлах
+        prepare_partitions(path_to_sessions, 'db_sessions', conn, cursor)
+        prepare_partitions(path_to_hits, 'db_hits', conn, cursor)
+
+        # Импорт обработанных данных из csv в таблицу db_sessions
+        ga_sessions_prep_sql = f'''
+            COPY db_sessions FROM '{path_to_sessions}' HEADER CSV
+        '''
+        execute_query(ga_sessions_prep_sql, conn, cursor)
+
+        # Импорт обработанных данных из csv в таблицу db_hits
+        ga_hits_prep_sql = f'''
+            COPY db_hits FROM '{path_to_hits}' HEADER CSV
+        '''
+        execute_query(ga_hits_prep_sql, conn, cursor)
+
+    if fast_load:
+        # Построение первичных ключей обеих таблиц одновременно
+        pk_sessions_sql = f'''
+        ALTER TABLE db_sessions ADD PRIMARY KEY ({sessions_key})
+        '''
+        pk_hits_sql = f'''
+        ALTER TABLE db_hits ADD PRIMARY KEY ({hits_key})
+        '''
+        build_keys([pk_sessions_sql, pk_hits_sql])
+
+    # Строки db_hits с значениями session_id, которых нет в db_sessions, удалены при обработке (preparation)
 
     # Создание внешнего ключа в таблице db_hits
-    fr_key_sql = f'''
+    if sessions_partitioned:
+        # Ключ секционированной db_sessions включает visit_date, внешний ключ только по session_id невозможен:
+        # строки hits без сессии отбрасываются при обработке и загрузке (loader)
+        logging.warning("Foreign key of 'db_hits' is not created: 'db_sessions' is partitioned.")
+    elif fast_load and partition_key('db_hits') is None:
+        # Ключ создается без проверки существующих строк (без долгой блокировки таблиц),
+        # проверка выполняется отдельным запросом
+        fr_key_sql = '''
+        ALTER TABLE db_hits ADD CONSTRAINT db_hits_session_id_fkey
+            FOREIGN KEY(session_id) REFERENCES db_sessions(session_id) NOT VALID
+        '''
+        execute_query(fr_key_sql, conn, cursor)
+
+        validate_fr_key_sql = '''
+        ALTER TABLE db_hits VALIDATE CONSTRAINT db_hits_session_id_fkey
+        '''
+        execute_query(validate_fr_key_sql, conn, cursor)
+    else:
+        # NOT VALID не поддерживается для внешнего ключа секционированной таблицы
+        fr_key_sql = f'''
         ALTER TABLE db_hits ADD FOREIGN KEY(session_id) REFERENCES db_sessions(session_id)
+        '''
+        execute_query(fr_key_sql, conn, cursor)
+
+    # Обновление статистики планировщика после загрузки
+    analyze_sql = '''
+        ANALYZE db_sessions, db_hits
     '''
-    execute_query(fr_key_sql, conn, cursor)
+    execute_query(analyze_sql, conn, cursor)
+
+    # Представления с расшифровкой идентификаторов справочников
+    if normalized():
+        create_views(cursor)
+        conn.commit()
+
+    # Расчет агрегатов по загруженным данным (далее обновляются при каждой загрузке новых данных)
+    if aggregates_enabled():
+        refresh_aggregates(cursor, conn)
 
-    conn.close()
     cursor.close()
+    release_connection(conn)
+
+    if load_mode == 'stream':
+        return
 
     # Удаление временных файлов
     if os.path.isfile(path_to_sessions):
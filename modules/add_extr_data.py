@@ -1,171 +1,279 @@
-import psycopg2
 import os
+import sys
 import logging
 import glob
 import json
+import multiprocessing
+import shutil
 import pandas as pd
 
-from sklearn.pipeline import Pipeline
-from sklearn.preprocessing import FunctionTransformer
-from sqlalchemy import create_engine
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
-from modules.DDL import parse_ini, create_connection, execute_query
-from modules.preparation import (
-    filter_data_hits, filter_data_sessions, corr_types_hits,
-    corr_types_sessions, fill_cat_col_hits, fill_cat_col_sessions
-)
+import modules.preparation as preparation
 
+from modules.backend import get_backend
+from modules.config import parse_ini, parse_option
+from modules.db import connection
+from modules.loader import load_df
+from modules.manifest import pending_files, register_file
+from modules.metrics import instrument_steps
+from modules.preparation import save_rejects, save_to_parquet
+from modules.profiler import FileProfile, check_drift, profile_needed
+from modules.schema import dataset_of
 
-path_info, conn_info = parse_ini()
+
+path_info, _ = parse_ini()
 path = os.environ.get('PROJECT_PATH', path_info)
 
+# Размер пакета записей при потоковом чтении json-файлов
+batch_size = int(parse_option('extra_data', 'batch_size', fallback='100000'))
+
 
-def file_to_df(
-        file_path: str
-) -> pd.DataFrame:
+def iter_json_records(
+        file_path: str,
+        read_size: int = 1 << 20
+) -> Iterator[Dict]:
     """
-    Функция загрузки из json в pandas.dataframe
+    Функция потокового чтения записей из json-файла вида {date: [records...]} без загрузки файла целиком
     """
 
+    decoder = json.JSONDecoder()
     with open(file_path, 'r') as j:
-        j_data = json.load(j)
-    file_date = list(j_data.keys())[0]
-    if len(j_data[file_date]) < 1:
+        buffer, pos, eof, started = '', 0, False, False
+        while True:
+            # Пропуск пробелов и разделителей между записями
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+
+            if pos < len(buffer):
+                if not started:
+                    # Пропуск заголовка '{"<date>": [' до начала списка записей
+                    start = buffer.find('[', pos)
+                    if start >= 0:
+                        pos, started = start + 1, True
+                        continue
+                elif buffer[pos] == ']':
+                    break
+                else:
+                    try:
+                        record, pos = decoder.raw_decode(buffer, pos)
+                        yield record
+                        continue
+                    except json.JSONDecodeError:
+                        # Запись прочитана не полностью - дочитываем файл
+                        if eof:
+                            raise
+
+            if eof:
+                break
+            chunk = j.read(read_size)
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+
+
+def iter_file_batches(
+        file_path: str,
+        batch_size: int,
+        profile: Optional[FileProfile] = None
+) -> Iterator[pd.DataFrame]:
+    """
+    Функция загрузки из json в датафрейм движка обработки пакетами фиксированного размера
+    (с профилированием исходных записей в том же проходе, если передан накопитель профиля)
+    """
+
+    backend = get_backend()
+    dataset = dataset_of(file_path)
+    batch, rows = [], 0
+    for record in iter_json_records(file_path):
+        batch.append(record)
+        if len(batch) == batch_size:
+            rows += len(batch)
+            if profile is not None:
+                profile.update(pd.DataFrame(batch))
+            yield backend.from_records(batch, dataset)
+            batch = []
+    if batch:
+        rows += len(batch)
+        if profile is not None:
+            profile.update(pd.DataFrame(batch))
+        yield backend.from_records(batch, dataset)
+
+    if rows == 0:
         logging.warning(f" Data \'{file_path.split('/')[-1]}\' is empty.\n")
-        df = None
     else:
-        df = pd.DataFrame(j_data[file_date])
-        logging.info(f" * SUCCESS *: Read file \'{file_path.split('/')[-1]}\' complete.")
-    return df
+        logging.info(f" * SUCCESS *: Read file \'{file_path.split('/')[-1]}\' complete ({rows} rows).")
 
 
-def del_na_hits(
-        df: pd.DataFrame
-) -> pd.DataFrame:
+def file_date(
+        file: str
+) -> str:
     """
-    Функция удаления пропусков в числовых колонках в hits
+    Функция извлечения даты из имени файла
     """
 
-    col = [
-        'hit_date',
-        'hit_number',
-        'session_id'
-    ]
-    for i in col:
-        df = df[df[i].notna()]
-    return df
+    return file.split('/')[-1].split('_')[-1].split('.')[0]
 
 
-def del_na_sessions(
-        df: pd.DataFrame
-) -> pd.DataFrame:
+def order_files(
+        files: List[str]
+) -> List[str]:
     """
-    Функция удаления пропусков в числовых колонках в sessions
+    Функция упорядочивания файлов для загрузки: файлы sessions по датам, затем файлы hits по датам
     """
 
-    col = [
-        'visit_number',
-        'visit_time',
-        'visit_date',
-        'session_id',
-        'client_id'
-    ]
-    for i in col:
-        df = df[df[i].notna()]
-    return df
+    return sorted(files, key=lambda file: (dataset_of(file) != 'sessions', file_date(file), file))
 
 
-def insert_into_table(
-        df: pd.DataFrame,
-        table: str,
+def iter_prep_batches(
         file: str,
-        cur: psycopg2.extensions.cursor,
-        conn: psycopg2.extensions.connection
-) -> None:
+        profile: Optional[FileProfile] = None
+) -> Iterator[pd.DataFrame]:
     """
-    Функция импорта датафрейма в БД
+    Функция потоковой обработки json-файла пакетами
     """
 
-    values = "VALUES({})".format(",".join(["%s" for _ in df.columns]))
+    backend = get_backend()
+    steps = instrument_steps(backend.prep_steps(dataset_of(file)), file)
+
+    # Отклоненные строки записываются в отдельный файл исходного файла (перезаписывается при повторной обработке)
+    source = file.split('/')[-1].split('.')[0]
+    rejects_path = f'{path_info}/data/rejects/{source}_rejects.csv'
+    if os.path.isfile(rejects_path):
+        os.remove(rejects_path)
+
+    for df in iter_file_batches(file, batch_size, profile):
+        preparation.rejects_buffer = []
+        try:
+            for step in steps:
+                df = step(df)
+        finally:
+            rejects, preparation.rejects_buffer = preparation.rejects_buffer, None
+        for rejected, dataset in rejects:
+            save_rejects(rejected, dataset, source)
+        yield backend.to_pandas(df)
 
-    # Создание строки колонок, разделенных запятой
-    cols = ','.join(list(df.columns))
 
-    # SQL запрос на добавление в БД
-    query = f"INSERT INTO {table} ({cols}) {values} ON CONFLICT DO NOTHING"
+def prep_file(
+        file: str,
+        prefix: str = 'spill'
+) -> Optional[List[str]]:
+    """
+    Функция обработки json-файла с сохранением пакетов в parquet (по части на пакет): память процесса ограничена
+    размером пакета, возвращаются пути к частям; профиль файла строится в том же проходе, при несоответствии
+    схеме БД части удаляются (None - файл не загружается)
+    """
 
+    name = f"{prefix}_{file.split('/')[-1].split('.')[0]}"
+    parts_dir = f'{path_info}/data/prep_data/{name}.parquet'
+    profile = FileProfile(file) if profile_needed(file) else None
+    parts = []
     try:
-        cur.executemany(query, df.values)
-        conn.commit()
-        logging.info(f" * SUCCESS *: Add data from {file.split('/')[-1]} complete.\n")
+        for n, df in enumerate(iter_prep_batches(file, profile)):
+            save_to_parquet(df, name, part=n)
+            parts.append(f'{parts_dir}/part-{n:05d}.parquet')
+    except Exception:
+        # Ошибка обработки (например, значения вне диапазона SMALLINT) до окончания прохода:
+        # файл проверяется по полному профилю, ошибка передается дальше, если схема БД не нарушена
+        shutil.rmtree(parts_dir, ignore_errors=True)
+        if not check_drift(file):
+            return None
+        raise
+
+    if profile is not None:
+        profile.save()
+    if not check_drift(file):
+        shutil.rmtree(parts_dir, ignore_errors=True)
+        return None
+    return parts
+
+
+def iter_spilled(
+        parts: List[str]
+) -> Iterator[pd.DataFrame]:
+    """
+    Функция чтения сохраненных процессом-обработчиком пакетов по одному с удалением набора после чтения
+    """
 
-    except Exception as e:
-        logging.error(f"{type(e).__name__}: {e} ")
-        conn.rollback()
+    for part in parts:
+        # Типы колонок (категории, даты, SMALLINT) сохранены в parquet
+        yield pd.read_parquet(part, memory_map=True)
+    if parts:
+        shutil.rmtree(os.path.dirname(parts[0]))
 
 
-def pipeline():
+def iter_prepared(
+        files: List[str],
+        workers: int
+) -> Iterator[Tuple[str, Iterable[pd.DataFrame]]]:
+    """
+    Функция обработки файлов (параллельно в пуле процессов при workers > 1) с выдачей пакетов
+    строго в порядке списка файлов (None - файл не соответствует схеме БД по профилю)
+    """
+
+    if workers <= 1:
+        for file in files:
+            if not profile_needed(file):
+                # Профиль уже построен (или проверка отключена) - пакеты загружаются по мере обработки
+                yield file, iter_prep_batches(file) if check_drift(file) else None
+                continue
+            # Профиль строится в проходе обработки - пакеты ожидают проверки файла на диске
+            parts = prep_file(file)
+            yield file, None if parts is None else iter_spilled(parts)
+        return
+
+    start_method = get_backend().start_method
+    mp_context = multiprocessing.get_context(start_method) if start_method else None
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as executor:
+        # Ограниченное окно задач: обработчики опережают загрузку в БД не более чем на 2 * workers файлов,
+        # обработанные пакеты ожидают загрузки на диске, в память читаются по одному
+        window = deque()
+        for file in files:
+            window.append((file, executor.submit(prep_file, file)))
+            if len(window) > 2 * workers:
+                done_file, future = window.popleft()
+                parts = future.result()
+                yield done_file, None if parts is None else iter_spilled(parts)
+        while window:
+            done_file, future = window.popleft()
+            parts = future.result()
+            yield done_file, None if parts is None else iter_spilled(parts)
+
+
+def pipeline(
+        force: bool = False
+) -> None:
     """
     Главная функция
     """
 
     logging.info('\n-------------------Add new/extra data-------------------\n')
 
-    # Конвейер обработки файлов hits
-    preprocessor_hits = Pipeline([
-        ('filter_hits', FunctionTransformer(filter_data_hits)),
-        ('fill_cat_columns_hits', FunctionTransformer(fill_cat_col_hits)),
-        ('del_na_hits', FunctionTransformer(del_na_hits)),
-        ('types_hits', FunctionTransformer(corr_types_hits))
-    ])
-
-    # Конвейер обработки файлов sessions
-    preprocessor_sessions = Pipeline([
-        ('filter_sessions', FunctionTransformer(filter_data_sessions)),
-        ('fill_cat_columns_sessions', FunctionTransformer(fill_cat_col_sessions)),
-        ('del_na_sessions', FunctionTransformer(del_na_sessions)),
-        ('types_sessions', FunctionTransformer(corr_types_sessions))
-    ])
-
-    # Создание списков имен файлов вместе с путями
-    extra_files = glob.glob(f'{path}/data/extra_data/*.json')
-    files_session = [x for x in extra_files if 'session' in x]
-    files_hits = [x for x in extra_files if 'hits' in x]
-
-    # Создание отсортированного списка дат из имен файлов
-    dates_files = sorted(list({x.split('/')[-1].split('_')[-1].split('.')[0] for x in extra_files}))
-
-    engine = create_engine(f"postgresql+psycopg2://{conn_info['user']}:{conn_info['password']}@{conn_info['host']}"+
-                           f":{conn_info['port']}/{conn_info['database']}")
-
-    conn = create_connection(conn_info)
-    cur = conn.cursor()
-
-    # Обработка и импорт в БД файлов sessions
-    for date in dates_files:
-        for file in files_session:
-            if date in file:
-                df = file_to_df(file)
-                if df is not None:
-                    pipe_sessions = preprocessor_sessions.fit_transform(df)
-                    insert_into_table(pipe_sessions, 'db_sessions', file, cur, conn)
-
-    # Создание списка session_id из таблицы db_sessions в БД
-    columns = list(pd.read_sql('SELECT session_id FROM db_sessions', con=engine).to_dict()['session_id'].values())
-
-    # Обработка и импорт в БД файлов hits
-    for date in dates_files:
-        for file in files_hits:
-            if date in file:
-                df = file_to_df(file)
-                if df is not None:
-                    pipe_hits = preprocessor_hits.fit_transform(df)
-
-                    # Удаление строк, у которых session_id отсутствует в таблице db_sessions
-                    pipe_hits = pipe_hits[pipe_hits.session_id.isin(columns)]
-
-                    insert_into_table(pipe_hits, 'db_hits', file, cur, conn)
+    # Количество процессов-обработчиков файлов
+    workers = int(parse_option('extra_data', 'workers', fallback='1'))
+
+    # Создание списка новых и измененных файлов (при force - всех файлов) вместе с путями
+    extra_files = [x for x in glob.glob(f'{path}/data/extra_data/*.json') if 'session' in x or 'hits' in x]
+    with connection() as conn:
+        files = order_files(pending_files(extra_files, conn.cursor(), conn, force))
+
+    # Обработка и импорт в БД в порядке загрузки файлов
+    for file, batches in iter_prepared(files, workers):
+        # Файлы, не соответствующие схеме БД (по профилю), не загружаются и остаются необработанными
+        if batches is None:
+            continue
+        table = 'db_sessions' if dataset_of(file) == 'sessions' else 'db_hits'
+        loaded = True
+        for df in batches:
+            # Строки hits, у которых session_id отсутствует в таблице db_sessions, отбрасываются в БД
+            loaded = load_df(df, table, file) is not None and loaded
+
+        # Файл отмечается загруженным только при успешной загрузке всех пакетов
+        if loaded:
+            with connection() as conn:
+                register_file(file, conn.cursor(), conn)
 
 
 if __name__ == "__main__":
-    pipeline()
+    pipeline(force='--force' in sys.argv)
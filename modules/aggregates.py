@@ -0,0 +1,124 @@
+import logging
+import psycopg2
+
+from typing import List, Optional
+
+from modules.config import parse_option
+from modules.db import connection
+from modules.dimensions import dimension_type
+
+
+# Агрегаты по дням: таблица, колонка даты, измерения и показатели (аддитивные, допускают прибавление приращений)
+AGGREGATES = {
+    'db_sessions': {
+        'table': 'agg_sessions_daily',
+        'date': 'visit_date',
+        'dims': ['utm_source', 'utm_medium', 'device_category', 'geo_country', 'geo_city'],
+        'measures': {
+            'sessions': 'count(*)',
+            'new_sessions': 'count(*) FILTER (WHERE visit_number = 1)'
+        }
+    },
+    'db_hits': {
+        'table': 'agg_hits_daily',
+        'date': 'hit_date',
+        'dims': ['event_category', 'event_action'],
+        'measures': {
+            'hits': 'count(*)'
+        }
+    }
+}
+
+
+def aggregates_enabled() -> bool:
+    """
+    Функция проверки, включено ли ведение агрегатов в конфигурационном файле
+    """
+
+    return parse_option('aggregates', 'enabled', fallback='false') == 'true'
+
+
+def create_aggregates(
+        cur: psycopg2.extensions.cursor
+) -> None:
+    """
+    Функция создания таблиц агрегатов
+    """
+
+    for agg in AGGREGATES.values():
+        dims = ''.join(f'{dim} {dimension_type()} NOT NULL, ' for dim in agg['dims'])
+        measures = ''.join(f'{measure} BIGINT NOT NULL, ' for measure in agg['measures'])
+        key = ', '.join([agg['date']] + agg['dims'])
+        cur.execute(f"CREATE TABLE IF NOT EXISTS {agg['table']} "
+                    f"({agg['date']} DATE NOT NULL, {dims}{measures}PRIMARY KEY ({key}))")
+
+
+def rollup_query(
+        table: str,
+        rows: str,
+        condition: Optional[str] = None
+) -> str:
+    """
+    Функция формирования запроса агрегации строк по дням и измерениям (строки без даты не учитываются)
+    """
+
+    agg = AGGREGATES[table]
+    group = ', '.join([agg['date']] + agg['dims'])
+    measures = ', '.join(agg['measures'].values())
+    where = f"{agg['date']} IS NOT NULL" + (f' AND {condition}' if condition else '')
+    return f"SELECT {group}, {measures} FROM {rows} WHERE {where} GROUP BY {group}"
+
+
+def merge_with_rollup(
+        table: str,
+        query: str
+) -> str:
+    """
+    Функция дополнения запроса переноса строк обновлением агрегатов по фактически вставленным строкам
+    (один запрос: вставка возвращает новые строки, их агрегаты прибавляются к таблице агрегатов)
+    """
+
+    agg = AGGREGATES[table]
+    key = ', '.join([agg['date']] + agg['dims'])
+    measures = list(agg['measures'])
+    update = ', '.join(f"{measure} = {agg['table']}.{measure} + EXCLUDED.{measure}" for measure in measures)
+    return f'''
+        WITH inserted AS ({query} RETURNING *),
+        rollup AS (
+            INSERT INTO {agg['table']} ({key}, {', '.join(measures)}) {rollup_query(table, 'inserted')}
+            ON CONFLICT ({key}) DO UPDATE SET {update}
+        )
+        SELECT count(*) FROM inserted
+    '''
+
+
+def refresh_aggregates(
+        cur: psycopg2.extensions.cursor,
+        conn: psycopg2.extensions.connection,
+        dates: Optional[List[str]] = None
+) -> None:
+    """
+    Функция полного пересчета агрегатов (или пересчета только указанных дат)
+    """
+
+    try:
+        create_aggregates(cur)
+        for table, agg in AGGREGATES.items():
+            key = ', '.join([agg['date']] + agg['dims'] + list(agg['measures']))
+            if dates is None:
+                cur.execute(f"TRUNCATE {agg['table']}")
+                cur.execute(f"INSERT INTO {agg['table']} ({key}) {rollup_query(table, table)}")
+            else:
+                cur.execute(f"DELETE FROM {agg['table']} WHERE {agg['date']} = ANY(%s::date[])", (dates,))
+                cur.execute(f"INSERT INTO {agg['table']} ({key}) "
+                            f"{rollup_query(table, table, agg['date'] + ' = ANY(%s::date[])')}", (dates,))
+        conn.commit()
+        logging.info(f" * SUCCESS *: Refresh aggregates {[agg['table'] for agg in AGGREGATES.values()]} complete.")
+    except Exception as e:
+        logging.error(f"{type(e).__name__}: {e} ")
+        conn.rollback()
+
+
+if __name__ == "__main__":
+    with connection() as conn:
+        refresh_aggregates(conn.cursor(), conn)
@@ -0,0 +1,317 @@
+import os
+import numpy as np
+import pandas as pd
+
+from typing import Callable, Dict, Iterator, List, Optional, Union
+
+from modules.config import parse_option
+from modules.partitions import partition_key
+from modules.profiler import FileProfile
+from modules.schema import SCHEMA, TRANSFORMS, apply_schema, read_csv_kwargs
+
+
+# Значения, читаемые как пропуск (как в pandas.read_csv по умолчанию)
+NA_VALUES = [
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+]
+
+
+class PandasBackend:
+    """
+    Движок обработки данных на pandas (по умолчанию)
+    """
+
+    name = 'pandas'
+    # Способ запуска процессов-обработчиков (None - по умолчанию для платформы)
+    start_method = None
+
+    def read_csv(
+            self,
+            path: str,
+            dataset: str,
+            chunksize: int,
+            profile: Optional[FileProfile] = None
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Метод чтения csv-файла по чанкам (целиком при chunksize <= 0) с типами схемы датасета
+        (с профилированием исходных значений в том же проходе, если передан накопитель профиля)
+        """
+
+        if profile is None:
+            if chunksize <= 0:
+                yield pd.read_csv(path, **read_csv_kwargs(dataset))
+                return
+            yield from pd.read_csv(path, chunksize=chunksize, **read_csv_kwargs(dataset))
+            return
+
+        # Профиль строится по исходным строкам (при чтении с типами значения вне диапазона SMALLINT искажаются),
+        # типы схемы применяются как для json; даты разбираются при обработке по фиксированному формату
+        if chunksize <= 0:
+            chunks = [pd.read_csv(path, dtype=str)]
+        else:
+            chunks = pd.read_csv(path, dtype=str, chunksize=chunksize)
+        for chunk in chunks:
+            profile.update(chunk)
+            yield apply_schema(chunk, dataset)
+
+    def from_records(
+            self,
+            records: List[Dict],
+            dataset: str
+    ) -> pd.DataFrame:
+        """
+        Метод сборки датафрейма из записей json с типами схемы датасета
+        """
+
+        return apply_schema(pd.DataFrame(records), dataset)
+
+    def prep_steps(
+            self,
+            dataset: str
+    ) -> List[Callable[[pd.DataFrame], pd.DataFrame]]:
+        """
+        Метод получения шагов обработки датасета
+        """
+
+        # Отложенный импорт: модуль preparation сам импортирует backend
+        from modules.preparation import PREP_STEPS
+        return PREP_STEPS[dataset]
+
+    def row_hashes(
+            self,
+            df: pd.DataFrame
+    ) -> np.ndarray:
+        """
+        Метод вычисления 64-битных хэшей строк
+        """
+
+        return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+    def take(
+            self,
+            df: pd.DataFrame,
+            mask: np.ndarray
+    ) -> pd.DataFrame:
+        """
+        Метод отбора строк по маске
+        """
+
+        return df[mask]
+
+    def to_pandas(
+            self,
+            df: pd.DataFrame
+    ) -> pd.DataFrame:
+        """
+        Метод преобразования в pandas.DataFrame для загрузки в БД и сохранения
+        """
+
+        return df
+
+
+class PolarsBackend:
+    """
+    Движок обработки данных на polars: многопоточное чтение csv, обработка по спецификации и хэширование строк
+    в колоночном формате Arrow; в pandas.DataFrame преобразуется только результат обработки
+    """
+
+    name = 'polars'
+    # Пул потоков polars не переживает fork - процессы-обработчики запускаются через spawn
+    start_method = 'spawn'
+
+    def __init__(self) -> None:
+        # Число потоков polars задается до импорта (0 - по числу ядер)
+        threads = int(parse_option('backend', 'threads', fallback='0'))
+        if threads > 0:
+            os.environ.setdefault('POLARS_MAX_THREADS', str(threads))
+        try:
+            import polars
+        except ImportError as e:
+            raise ImportError("Backend 'polars' requires the polars package (pip install polars)") from e
+        self.pl = polars
+
+    def cast_schema(
+            self,
+            df: 'polars.DataFrame',
+            dataset: str
+    ) -> 'polars.DataFrame':
+        """
+        Метод приведения колонок к типам схемы датасета (некорректные числа - пропуски);
+        категориальные колонки приводятся к Categorical после заполнения пропусков
+        """
+
+        pl = self.pl
+        exprs = []
+        for col, dtype in SCHEMA[dataset]['dtypes'].items():
+            if col not in df.columns:
+                continue
+            if dtype == 'Int16':
+                exprs.append(pl.col(col).cast(pl.Int16, strict=False))
+            else:
+                exprs.append(pl.col(col).cast(pl.String))
+        return df.with_columns(exprs)
+
+    def read_csv(
+            self,
+            path: str,
+            dataset: str,
+            chunksize: int,
+            profile: Optional[FileProfile] = None
+    ) -> Iterator['polars.DataFrame']:
+        """
+        Метод чтения csv-файла по чанкам (целиком при chunksize <= 0) с типами схемы датасета
+        (с профилированием исходных значений в том же проходе, если передан накопитель профиля)
+        """
+
+        lf = self.pl.scan_csv(path, infer_schema=False, null_values=NA_VALUES)
+        batches = [lf.collect()] if chunksize <= 0 else lf.collect_batches(chunk_size=chunksize)
+        for batch in batches:
+            # Чанк прочитан строками: профиль строится до приведения типов
+            if profile is not None:
+                profile.update(batch.to_pandas())
+            yield self.cast_schema(batch, dataset)
+
+    def from_records(
+            self,
+            records: List[Dict],
+            dataset: str
+    ) -> 'polars.DataFrame':
+        """
+        Метод сборки датафрейма из записей json с типами схемы датасета
+        """
+
+        # Записи json разбираются в pandas; удаляемые колонки (смешанных типов) не передаются в polars
+        df = pd.DataFrame(records)
+        df = df.drop(columns=[col for col in TRANSFORMS[dataset]['drop'] if col in df.columns])
+        return self.cast_schema(self.pl.from_pandas(apply_schema(df, dataset)), dataset)
+
+    def apply_spec(
+            self,
+            df: 'polars.DataFrame',
+            dataset: str
+    ) -> 'polars.DataFrame':
+        """
+        Метод обработки датафрейма по спецификации датасета одним запросом: удаление колонок и строк с пропусками
+        в обязательных колонках, заполнение пропусков, приведение типов и разбор дат с отбором некорректных строк
+        """
+
+        # Отложенный импорт: модуль preparation сам импортирует backend
+        from modules.preparation import save_rejects
+
+        pl = self.pl
+        spec = TRANSFORMS[dataset]
+        categories = {col for col, dtype in SCHEMA[dataset]['dtypes'].items() if dtype == 'category'}
+
+        lf = df.lazy().drop([col for col in spec['drop'] if col in df.columns])
+        lf = lf.filter(pl.all_horizontal([pl.col(col).is_not_null() for col in spec['required']]))
+
+        exprs = []
+        for col, value in spec['fill'].items():
+            if col not in df.columns:
+                continue
+            expr = pl.col(col).cast(pl.String).fill_null(value)
+            exprs.append(expr.cast(pl.Categorical) if col in categories else expr)
+        for col, dtype in spec['types'].items():
+            if col not in df.columns:
+                continue
+            exprs.append(pl.col(col).cast(getattr(pl, dtype.capitalize())))
+        exprs += [pl.col(col).cast(pl.Categorical) for col in categories - set(spec['fill']) if col in df.columns]
+
+        # Разбор дат и времени по фиксированному формату; колонка секционирования обязательна (NOT NULL в БД)
+        key = partition_key(f'db_{dataset}')
+        reasons = []
+        for col, (fmt, required) in SCHEMA[dataset]['formats'].items():
+            required = required or col == key
+            if fmt == '%H:%M:%S':
+                parsed = pl.col(col).str.strptime(pl.Time, fmt, strict=False).dt.to_string(fmt)
+            else:
+                parsed = pl.col(col).str.strptime(pl.Date, fmt, strict=False)
+            exprs.append(parsed.alias(f'__parsed_{col}'))
+            bad = pl.col(f'__parsed_{col}').is_null() & (pl.col(col).is_not_null() | required)
+            reasons.append(pl.when(bad).then(pl.lit(f'{col};')).otherwise(pl.lit('')))
+
+        df = lf.with_columns(exprs).with_columns(
+            pl.concat_str(reasons).str.strip_chars_end(';').alias('reject_reason')
+        ).collect()
+
+        parsed_cols = [f'__parsed_{col}' for col in SCHEMA[dataset]['formats']]
+        rejected = df['reject_reason'] != ''
+        if rejected.any():
+            save_rejects(df.filter(rejected).drop(parsed_cols).to_pandas(), dataset)
+            df = df.filter(~rejected)
+
+        return df.with_columns(
+            [pl.col(f'__parsed_{col}').alias(col) for col in SCHEMA[dataset]['formats']]
+        ).drop(parsed_cols + ['reject_reason'])
+
+    def prep_steps(
+            self,
+            dataset: str
+    ) -> List[Callable[['polars.DataFrame'], 'polars.DataFrame']]:
+        """
+        Метод получения шагов обработки датасета
+        """
+
+        def prep_spec(df: 'polars.DataFrame') -> 'polars.DataFrame':
+            return self.apply_spec(df, dataset)
+
+        prep_spec.__name__ = f'prep_{dataset}_spec'
+        return [prep_spec]
+
+    def row_hashes(
+            self,
+            df: 'polars.DataFrame'
+    ) -> np.ndarray:
+        """
+        Метод вычисления 64-битных хэшей строк
+        """
+
+        return df.hash_rows().to_numpy()
+
+    def take(
+            self,
+            df: 'polars.DataFrame',
+            mask: np.ndarray
+    ) -> 'polars.DataFrame':
+        """
+        Метод отбора строк по маске
+        """
+
+        return df.filter(self.pl.Series(mask))
+
+    def to_pandas(
+            self,
+            df: 'polars.DataFrame'
+    ) -> pd.DataFrame:
+        """
+        Метод преобразования в pandas.DataFrame для загрузки в БД и сохранения (даты - datetime64[ns], как у pandas)
+        """
+
+        pl = self.pl
+        return df.with_columns(pl.col(pl.Date).cast(pl.Datetime('ns'))).to_pandas()
+
+
+# Доступные движки обработки
+BACKENDS = {
+    'pandas': PandasBackend,
+    'polars': PolarsBackend
+}
+
+# Созданные движки (один экземпляр на процесс)
+_backends = {}
+
+
+def get_backend(
+        engine: Optional[str] = None
+) -> Union[PandasBackend, PolarsBackend]:
+    """
+    Функция получения движка обработки данных (по умолчанию - из конфигурационного файла)
+    """
+
+    engine = engine or parse_option('backend', 'engine', fallback='pandas')
+    if engine not in BACKENDS:
+        raise ValueError(f"Unknown backend '{engine}', expected one of: {', '.join(BACKENDS)}")
+    if engine not in _backends:
+        _backends[engine] = BACKENDS[engine]()
+    return _backends[engine]
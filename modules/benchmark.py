@@ -0,0 +1,402 @@
+import argparse
+import datetime as dt
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+
+# Путь к коду проекта (для импорта modules.* в дочерних процессах)
+CODE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Этапы, доступные для замера
+STAGES = ['data_prep', 'ddl', 'pipeline', 'dag']
+
+# Значения низкокардинальных колонок (для реалистичного распределения - с убывающей частотой)
+VALUES = {
+    'utm_source': [f'src_{i}' for i in range(200)],
+    'utm_medium': ['banner', 'cpc', 'cpm', '(none)', 'organic', 'referral', 'email', 'push'],
+    'utm_campaign': [f'cmp_{i}' for i in range(300)],
+    'utm_adcontent': [f'ad_{i}' for i in range(250)],
+    'utm_keyword': [f'kw_{i}' for i in range(1000)],
+    'device_category': ['mobile', 'desktop', 'tablet'],
+    'device_os': ['Android', 'iOS', 'Windows', 'Macintosh', 'Linux'],
+    'device_brand': ['Apple', 'Samsung', 'Xiaomi', 'Huawei', 'Realme', 'OPPO', 'Vivo', 'Google', '(not set)'],
+    'device_model': [f'model_{i}' for i in range(100)],
+    'device_screen_resolution': [f'{w}x{h}' for w in (360, 375, 390, 414, 1366, 1440, 1920) for h in (640, 800, 1080)],
+    'device_browser': ['Chrome', 'Safari', 'YaBrowser', 'Samsung Internet', 'Firefox', 'Opera', 'Edge'],
+    'geo_country': ['Russia', 'United States', 'Ukraine', 'Belarus', 'Kazakhstan', 'Germany'],
+    'geo_city': [f'city_{i}' for i in range(500)],
+    'hit_type': ['event'],
+    'hit_page_path': [f'sberauto.com/cars/{i}?utm_source=src' for i in range(5000)],
+    'event_category': [f'category_{i}' for i in range(50)],
+    'event_action': [f'action_{i}' for i in range(230)],
+    'event_label': [f'label_{i}' for i in range(40)]
+}
+
+# Колонки с пропусками (доля пропусков задается параметром null_rate)
+NULLABLE = [
+    'utm_source', 'utm_campaign', 'utm_adcontent', 'utm_keyword', 'device_os', 'device_brand', 'device_model',
+    'hit_page_path', 'event_category', 'event_label'
+]
+
+
+def choice(
+        rng: np.random.Generator,
+        col: str,
+        size: int
+) -> np.ndarray:
+    """
+    Функция выбора значений колонки с распределением, близким к закону Ципфа
+    """
+
+    values = np.array(VALUES[col], dtype=object)
+    weights = 1 / np.arange(1, len(values) + 1)
+    return rng.choice(values, size=size, p=weights / weights.sum())
+
+
+def with_nulls(
+        df: pd.DataFrame,
+        rng: np.random.Generator,
+        null_rate: float
+) -> pd.DataFrame:
+    """
+    Функция добавления пропусков в колонки, допускающие пропуски
+    """
+
+    for col in NULLABLE:
+        if col in df.columns:
+            df[col] = df[col].where(rng.random(len(df)) >= null_rate, None)
+    return df
+
+
+def make_sessions(
+        rng: np.random.Generator,
+        n: int,
+        dates: List[str],
+        prefix: str,
+        null_rate: float
+) -> pd.DataFrame:
+    """
+    Функция генерации сессий
+    """
+
+    ts = rng.integers(1_600_000_000, 1_700_000_000, n)
+    df = pd.DataFrame({
+        'session_id': [f'{prefix}{i}.{t}.{t}' for i, t in enumerate(ts)],
+        'client_id': [f'{c}.{t}' for c, t in zip(rng.integers(1, 2 ** 31, n), ts)],
+        'visit_date': rng.choice(np.array(dates, dtype=object), n),
+        'visit_time': [f'{h:02d}:{m:02d}:{s:02d}' for h, m, s in rng.integers(0, [24, 60, 60], (n, 3))],
+        'visit_number': rng.geometric(0.4, n).clip(max=500)
+    })
+    for col in ['utm_source', 'utm_medium', 'utm_campaign', 'utm_adcontent', 'utm_keyword', 'device_category',
+                'device_os', 'device_brand', 'device_model', 'device_screen_resolution', 'device_browser',
+                'geo_country', 'geo_city']:
+        df[col] = choice(rng, col, n)
+    return with_nulls(df, rng, null_rate)
+
+
+def make_hits(
+        rng: np.random.Generator,
+        sessions: pd.DataFrame,
+        hits_per_session: float,
+        orphan_rate: float,
+        null_rate: float
+) -> pd.DataFrame:
+    """
+    Функция генерации событий сессий (с долей событий несуществующих сессий)
+    """
+
+    counts = rng.poisson(hits_per_session - 1, len(sessions)) + 1
+    session_id = np.repeat(sessions['session_id'].to_numpy(), counts)
+    hit_date = np.repeat(sessions['visit_date'].to_numpy(), counts)
+
+    # События-сироты: идентификаторы сессий, отсутствующих в выгрузке сессий
+    orphan = np.flatnonzero(rng.random(len(session_id)) < orphan_rate)
+    session_id[orphan] = [f'orphan.{i}.{hit_date[i]}' for i in orphan]
+
+    # Номера событий внутри сессии: 1..count
+    n = len(session_id)
+    hit_number = np.arange(n) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+    df = pd.DataFrame({
+        'session_id': session_id,
+        'hit_date': hit_date,
+        'hit_time': rng.random(n) * 1e6,
+        'hit_number': hit_number,
+        'hit_type': choice(rng, 'hit_type', n),
+        'hit_referer': None,
+        'hit_page_path': choice(rng, 'hit_page_path', n),
+        'event_category': choice(rng, 'event_category', n),
+        'event_action': choice(rng, 'event_action', n),
+        'event_label': choice(rng, 'event_label', n),
+        'event_value': None
+    })
+    return with_nulls(df, rng, null_rate)
+
+
+def with_duplicates(
+        df: pd.DataFrame,
+        rng: np.random.Generator,
+        dup_rate: float
+) -> pd.DataFrame:
+    """
+    Функция добавления полных дубликатов строк
+    """
+
+    duplicates = df.iloc[rng.integers(0, len(df), int(len(df) * dup_rate))] if len(df) else df.iloc[:0]
+    return pd.concat([df, duplicates], ignore_index=True)
+
+
+def generate(
+        path: str,
+        sessions: int,
+        hits_per_session: float = 4.0,
+        extra_days: int = 2,
+        extra_sessions: int = 1000,
+        null_rate: float = 0.05,
+        dup_rate: float = 0.02,
+        orphan_rate: float = 0.01,
+        seed: int = 0
+) -> Dict[str, int]:
+    """
+    Функция генерации основной выгрузки (csv) и дополнительных выгрузок по дням (json вида {date: [records...]})
+    """
+
+    rng = np.random.default_rng(seed)
+    for folder in ('main_data', 'extra_data', 'prep_data', 'rejects'):
+        os.makedirs(f'{path}/data/{folder}', exist_ok=True)
+
+    # Основная выгрузка
+    dates = pd.date_range('2021-05-19', '2021-12-31').strftime('%Y-%m-%d').tolist()
+    ga_sessions = make_sessions(rng, sessions, dates, '', null_rate)
+    ga_hits = make_hits(rng, ga_sessions, hits_per_session, orphan_rate, null_rate)
+    ga_sessions = with_duplicates(ga_sessions, rng, dup_rate)
+    ga_hits = with_duplicates(ga_hits, rng, dup_rate)
+    ga_sessions.to_csv(f'{path}/data/main_data/ga_sessions.csv', index=False)
+    ga_hits.to_csv(f'{path}/data/main_data/ga_hits.csv', index=False)
+    rows = {'main_sessions': len(ga_sessions), 'main_hits': len(ga_hits), 'extra_sessions': 0, 'extra_hits': 0}
+
+    # Дополнительные выгрузки: новые сессии и их события за каждый день
+    for day in pd.date_range('2022-01-01', periods=extra_days).strftime('%Y-%m-%d'):
+        new_sessions = make_sessions(rng, extra_sessions, [day], f'new{day}.', null_rate)
+        new_hits = make_hits(rng, new_sessions, hits_per_session, orphan_rate, null_rate)
+        for name, df in (('sessions', new_sessions), ('hits', new_hits)):
+            df = with_duplicates(df, rng, dup_rate)
+            records = df.astype(object).where(df.notna(), None).to_dict('records')
+            with open(f'{path}/data/extra_data/ga_{name}_new_{day}.json', 'w') as j:
+                json.dump({day: records}, j, default=int)
+            rows[f'extra_{name}'] += len(df)
+
+    logging.info(f" * SUCCESS *: Generate benchmark data {rows} to \'{path}\' complete.")
+    return rows
+
+
+def admin_connection():
+    """
+    Функция создания соединения для создания и удаления БД
+    """
+
+    import psycopg2
+    from modules.config import parse_ini
+
+    _, conn_info = parse_ini()
+    conn = psycopg2.connect(**{**conn_info, 'database': 'template1'})
+    conn.autocommit = True
+    return conn
+
+
+def create_database(
+        database: str
+) -> None:
+    """
+    Функция создания отдельной БД для замеров
+    """
+
+    conn = admin_connection()
+    with conn.cursor() as cur:
+        cur.execute(f'DROP DATABASE IF EXISTS {database}')
+        cur.execute(f'CREATE DATABASE {database}')
+    conn.close()
+
+
+def drop_database(
+        database: str
+) -> None:
+    """
+    Функция удаления БД замеров
+    """
+
+    conn = admin_connection()
+    with conn.cursor() as cur:
+        cur.execute(f'DROP DATABASE IF EXISTS {database}')
+    conn.close()
+
+
+def run_stage(
+        stage: str
+) -> None:
+    """
+    Функция выполнения этапа конвейера
+    """
+
+    if stage == 'data_prep':
+        from modules.preparation import data_prep
+        data_prep()
+    elif stage == 'ddl':
+        from modules.DDL import ddl
+        ddl(create_database=False)
+    elif stage == 'pipeline':
+        from modules.add_extr_data import pipeline
+        pipeline(force=True)
+    elif stage == 'dag':
+        from modules import dag_tasks
+        # Повторная обработка всех файлов (как при запуске DAG с {"force": true})
+        context = {'dag_run': SimpleNamespace(conf={'force': True})}
+        for kwargs in dag_tasks.discover_dates(**context):
+            # Одна пара задач обработки и загрузки на каждую дату (как в группе задач DAG)
+            dag_tasks.preprocessing(**kwargs, **context)
+            dag_tasks.add_data(**kwargs, **context)
+
+
+def measure_stage(
+        stage: str,
+        queue: multiprocessing.Queue
+) -> None:
+    """
+    Функция замера времени и пиковой памяти этапа (выполняется в отдельном процессе)
+    """
+
+    sys.path.insert(0, CODE_PATH)
+    logging.basicConfig(level=logging.WARNING)
+    result = {'status': 'ok', 'error': None}
+    start = time.perf_counter()
+    try:
+        run_stage(stage)
+    except Exception as e:
+        result = {'status': 'failed', 'error': f'{type(e).__name__}: {e}'}
+    result['wall_s'] = round(time.perf_counter() - start, 3)
+
+    # ru_maxrss в Linux - в килобайтах
+    result['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    result['children_peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+    queue.put(result)
+
+
+def git_commit() -> Optional[str]:
+    """
+    Функция получения текущего коммита кода (для сравнения запусков)
+    """
+
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=CODE_PATH, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def benchmark(
+        stages: List[str],
+        scale: Dict,
+        output: Optional[str] = None,
+        workdir: Optional[str] = None,
+        keep: bool = False
+) -> List[Dict]:
+    """
+    Главная функция: генерация данных, создание отдельной БД, замер этапов и запись результатов (json lines)
+    """
+
+    path = workdir or tempfile.mkdtemp(prefix='etl_bench_')
+    database = f'etl_bench_{os.getpid()}'
+
+    # Дочерние процессы работают с тестовыми данными и отдельной БД
+    os.environ['PROJECT_PATH'] = path
+    os.environ['ETL_DATABASE'] = database
+
+    rows = generate(path, **scale)
+    stage_rows = {
+        'data_prep': rows['main_sessions'] + rows['main_hits'],
+        'ddl': rows['main_sessions'] + rows['main_hits'],
+        'pipeline': rows['extra_sessions'] + rows['extra_hits'],
+        'dag': rows['extra_sessions'] + rows['extra_hits']
+    }
+
+    create_database(database)
+    run_id = dt.datetime.now().strftime('%Y%m%dT%H%M%S')
+    results = []
+    context = multiprocessing.get_context('spawn')
+    try:
+        for stage in stages:
+            queue = context.Queue()
+            process = context.Process(target=measure_stage, args=(stage, queue))
+            process.start()
+            process.join()
+            result = queue.get() if not queue.empty() else {'status': 'failed', 'error': f'exit {process.exitcode}'}
+            result = {
+                'run_id': run_id,
+                'commit': git_commit(),
+                'stage': stage,
+                'rows': stage_rows[stage],
+                **result,
+                'rows_per_s': round(stage_rows[stage] / result['wall_s'], 1) if result.get('wall_s') else None,
+                'scale': scale
+            }
+            results.append(result)
+            line = json.dumps(result)
+            print(line, flush=True)
+            if output:
+                with open(output, 'a') as f:
+                    f.write(line + '\n')
+    finally:
+        if not keep:
+            drop_database(database)
+            if workdir is None:
+                shutil.rmtree(path, ignore_errors=True)
+    return results
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, CODE_PATH)
+
+    parser = argparse.ArgumentParser(description='Замер производительности этапов конвейера на синтетических данных')
+    parser.add_argument('--sessions', type=int, default=100_000, help='количество сессий основной выгрузки')
+    parser.add_argument('--hits-per-session', type=float, default=4.0, help='среднее количество событий сессии')
+    parser.add_argument('--extra-days', type=int, default=2, help='количество дней дополнительных выгрузок')
+    parser.add_argument('--extra-sessions', type=int, default=1000, help='количество сессий за день')
+    parser.add_argument('--null-rate', type=float, default=0.05, help='доля пропусков')
+    parser.add_argument('--dup-rate', type=float, default=0.02, help='доля дубликатов строк')
+    parser.add_argument('--orphan-rate', type=float, default=0.01, help='доля событий без сессии')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stages', default='data_prep,ddl,pipeline', help=f'этапы через запятую из {STAGES}')
+    parser.add_argument('--output', help='файл результатов (json lines, дописывается)')
+    parser.add_argument('--workdir', help='каталог данных (по умолчанию временный)')
+    parser.add_argument('--keep', action='store_true', help='не удалять данные и БД после замеров')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    benchmark(
+        stages=[stage for stage in args.stages.split(',') if stage in STAGES],
+        scale={
+            'sessions': args.sessions,
+            'hits_per_session': args.hits_per_session,
+            'extra_days': args.extra_days,
+            'extra_sessions': args.extra_sessions,
+            'null_rate': args.null_rate,
+            'dup_rate': args.dup_rate,
+            'orphan_rate': args.orphan_rate,
+            'seed': args.seed
+        },
+        output=args.output,
+        workdir=args.workdir,
+        keep=args.keep
+    )
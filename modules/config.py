@@ -0,0 +1,43 @@
+import os
+
+from configparser import ConfigParser
+from typing import Dict, Optional, Union
+
+
+def read_config() -> ConfigParser:
+    """
+    Функция чтения конфигурационного файла проекта
+    """
+    # Создание плавающего пути к исполняемому файлу
+    basedir = os.path.dirname(os.path.abspath(__file__))
+
+    parser = ConfigParser()
+    parser.read(os.path.join(basedir, 'ddl.ini'))
+    return parser
+
+
+def parse_ini() -> Union[str, Dict]:
+    """
+    Функция извлечения информации о пути проекта и подключении к БД из конфигурационного файла
+    """
+
+    parser = read_config()
+
+    # Путь к проекту и имя БД переопределяются переменными окружения (запуск на тестовых данных и в отдельной БД)
+    path_info = os.environ.get('PROJECT_PATH', parser.get('path', 'path'))
+    conn_info = {param[0]: param[1] for param in parser.items('postgresql')}
+    if 'ETL_DATABASE' in os.environ:
+        conn_info['database'] = os.environ['ETL_DATABASE']
+    return path_info, conn_info
+
+
+def parse_option(
+        section: str,
+        option: str,
+        fallback: Optional[str] = None
+) -> Optional[str]:
+    """
+    Функция извлечения дополнительного параметра из конфигурационного файла
+    """
+
+    return read_config().get(section, option, fallback=fallback)
@@ -0,0 +1,105 @@
+import glob
+import logging
+import shutil
+import pandas as pd
+
+from typing import Dict, List
+
+from modules.add_extr_data import file_date, order_files, prep_file
+from modules.config import parse_ini
+from modules.db import connection
+from modules.loader import load_df
+from modules.manifest import pending_files, register_file
+from modules.schema import dataset_of
+
+
+path, _ = parse_ini()
+
+
+def force_run(
+        context: Dict
+) -> bool:
+    """
+    Функция проверки запуска DAG с параметром {"force": true} (повторная обработка всех файлов)
+    """
+
+    dag_run = context.get('dag_run')
+    return bool((dag_run.conf or {}).get('force', False)) if dag_run is not None else False
+
+
+def discover_dates(**context) -> List[Dict[str, str]]:
+    """
+    Функция поиска дат с новыми и измененными json файлами
+    """
+
+    extra_files = glob.glob(f'{path}/data/extra_data/*.json')
+    with connection() as conn:
+        extra_files = pending_files(extra_files, conn.cursor(), conn, force_run(context))
+
+    # Одна пара задач обработки и загрузки на каждую дату
+    dates = sorted({file_date(file) for file in extra_files})
+    logging.info(f" Dates to process: {dates}.")
+    return [{'date': date} for date in dates]
+
+
+def preprocessing(
+        date: str,
+        **context
+) -> None:
+    """
+    Функция обработки данных в новых и измененных json файлах за дату
+    """
+
+    # Создание списка новых и измененных файлов за дату вместе с путями
+    extra_files = [x for x in glob.glob(f'{path}/data/extra_data/*.json') if file_date(x) == date]
+    with connection() as conn:
+        extra_files = pending_files(extra_files, conn.cursor(), conn, force_run(context))
+
+    # Обработка пакетами и сохранение в parquet (по части на пакет) для передачи в задачу загрузки;
+    # файлы, не соответствующие схеме БД (по профилю, построенному в том же проходе), не загружаются
+    for file in extra_files:
+        if prep_file(file, 'prep') == []:
+            # Пустой файл не передается в задачу загрузки и отмечается загруженным сразу
+            with connection() as conn:
+                register_file(file, conn.cursor(), conn)
+
+
+def add_data(
+        date: str,
+        **context
+) -> None:
+    """
+    Функция импорта обработанных данных за дату в БД
+    """
+
+    # Создание списка наборов parquet за дату вместе с путями в порядке загрузки (sessions, затем hits)
+    extra_files = order_files([x for x in glob.glob(f'{path}/data/prep_data/prep*.parquet') if file_date(x) == date])
+
+    # Импорт в БД наборов sessions и hits по частям
+    failed = []
+    for file in extra_files:
+        table = 'db_sessions' if dataset_of(file) == 'sessions' else 'db_hits'
+        loaded = True
+        for part in sorted(glob.glob(f'{file}/part-*.parquet')):
+            # Типы колонок (категории, даты, SMALLINT) сохранены в parquet, повторный вывод типов не нужен
+            df = pd.read_parquet(part, memory_map=True)
+
+            # Строки hits, у которых session_id отсутствует в таблице db_sessions, отбрасываются в БД
+            loaded = load_df(df, table, file) is not None and loaded
+
+        if not loaded:
+            failed.append(file.split('/')[-1])
+            continue
+
+        # Отметка исходного json файла как загруженного
+        source = file.split('/')[-1].split('.')[0][len('prep_'):]
+        with connection() as conn:
+            register_file(f'{path}/data/extra_data/{source}.json', conn.cursor(), conn)
+
+        # Удаление временных файлов (незагруженные остаются для повторной попытки)
+        shutil.rmtree(file)
+        logging.info(f" * SUCCESS *: Delete file \'{file.split('/')[-1]}\'.")
+
+    # Ошибка задачи приводит к повторной попытке только для этой даты
+    if failed:
+        raise RuntimeError(f"Loading of {failed} for date {date} failed.")
@@ -0,0 +1,200 @@
+import atexit
+import functools
+import logging
+import os
+import threading
+import time
+import psycopg2
+
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+
+from psycopg2.pool import ThreadedConnectionPool
+
+from modules.config import parse_ini, read_config
+
+
+# Ошибки соединения (среди них повторяются только ошибки потери соединения, см. is_transient)
+TRANSIENT_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+# Коды SQLSTATE потери соединения помимо класса 08: остановка сервера и запуск сервера
+CONNECTION_LOST_CODES = ('57P01', '57P02', '57P03')
+
+# Ошибки подключения без кода SQLSTATE, которые не исправляются повтором (неверные параметры подключения)
+PERMANENT_CONNECT_ERRORS = (
+    'does not exist',
+    'password authentication failed',
+    'no password supplied',
+    'no pg_hba.conf entry'
+)
+
+# Пул соединений процесса, идентификатор процесса, в котором он создан, и параметры пула
+_pool = None
+_pool_pid = None
+_settings = None
+
+# Признак выполнения операции с повтором в текущем потоке (вложенные операции повтором не оборачиваются)
+_retry_state = threading.local()
+
+
+def pool_settings() -> Dict[str, float]:
+    """
+    Функция извлечения параметров пула соединений из конфигурационного файла (считываются один раз на процесс)
+    """
+
+    global _settings
+
+    if _settings is None:
+        parser = read_config()
+        _settings = {
+            'minconn': parser.getint('pool', 'minconn', fallback=1),
+            'maxconn': parser.getint('pool', 'maxconn', fallback=8),
+            'statement_timeout': parser.getint('pool', 'statement_timeout', fallback=0),
+            'connect_timeout': parser.getint('pool', 'connect_timeout', fallback=10),
+            'retries': parser.getint('pool', 'retries', fallback=5),
+            'backoff': parser.getfloat('pool', 'backoff', fallback=1.0)
+        }
+    return _settings
+
+
+def is_transient(
+        e: Exception
+) -> bool:
+    """
+    Функция проверки, что ошибка вызвана потерей соединения с БД (перезапуск сервера, обрыв сети) и операцию
+    можно повторить в новом соединении
+    """
+
+    if isinstance(e, psycopg2.InterfaceError):
+        # Операция над уже закрытым соединением
+        return True
+    if not isinstance(e, psycopg2.OperationalError):
+        return False
+    if e.pgcode is not None:
+        # Ошибки выполнения запроса (отмена по statement_timeout, взаимоблокировка) не повторяются
+        return e.pgcode.startswith('08') or e.pgcode in CONNECTION_LOST_CODES
+    # Ошибки libpq без кода: обрыв соединения, отказ в подключении или неверные параметры подключения
+    return not any(text in str(e) for text in PERMANENT_CONNECT_ERRORS)
+
+
+def retry(
+        func: Callable
+) -> Callable:
+    """
+    Функция-декоратор повтора операции при потере соединения с экспоненциально растущей паузой; повторяется только
+    внешняя операция: вложенные операции с повтором (получение соединения внутри load_df) выполняются один раз
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if getattr(_retry_state, 'active', False):
+            return func(*args, **kwargs)
+
+        settings = pool_settings()
+        _retry_state.active = True
+        try:
+            for attempt in range(settings['retries'] + 1):
+                try:
+                    return func(*args, **kwargs)
+                except TRANSIENT_ERRORS as e:
+                    if not is_transient(e) or attempt == settings['retries']:
+                        raise
+                    delay = settings['backoff'] * 2 ** attempt
+                    logging.warning(f"{type(e).__name__}: '{e}' occurred. Retry {attempt + 1} of "
+                                    f"{settings['retries']} in {delay:.1f} s.")
+                    time.sleep(delay)
+        finally:
+            _retry_state.active = False
+
+    return wrapper
+
+
+def get_pool(
+        connect_info: Optional[Dict[str, str]] = None
+) -> ThreadedConnectionPool:
+    """
+    Функция создания пула соединений с БД (один пул на процесс); повтор при недоступности БД выполняет вызывающая
+    операция (get_connection, load_df)
+    """
+
+    global _pool, _pool_pid
+
+    # Соединения родительского процесса не используются в дочерних (fork)
+    if _pool is not None and _pool_pid == os.getpid():
+        return _pool
+
+    if connect_info is None:
+        _, connect_info = parse_ini()
+    settings = pool_settings()
+
+    _pool = ThreadedConnectionPool(
+        settings['minconn'],
+        settings['maxconn'],
+        connect_timeout=settings['connect_timeout'],
+        options=f"-c statement_timeout={settings['statement_timeout']}",
+        **connect_info
+    )
+    _pool_pid = os.getpid()
+    logging.info(f" * SUCCESS *: Connection pool to PostgreSQL (user:{connect_info['user']}, "
+                 f"database:{connect_info['database']}, size:{settings['maxconn']}) created.")
+    return _pool
+
+
+@retry
+def get_connection() -> psycopg2.extensions.connection:
+    """
+    Функция получения проверенного соединения из пула
+    """
+
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        # Соединение могло быть разорвано сервером, пока находилось в пуле
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+    except TRANSIENT_ERRORS:
+        pool.putconn(conn, close=True)
+        raise
+    return conn
+
+
+def release_connection(
+        conn: psycopg2.extensions.connection
+) -> None:
+    """
+    Функция возврата соединения в пул (разорванные соединения закрываются)
+    """
+
+    if conn.closed == 0:
+        try:
+            conn.rollback()
+        except TRANSIENT_ERRORS:
+            pass
+    get_pool().putconn(conn, close=conn.closed != 0)
+
+
+@contextmanager
+def connection() -> Iterator[psycopg2.extensions.connection]:
+    """
+    Функция-контекстный менеджер соединения из пула
+    """
+
+    conn = get_connection()
+    try:
+        yield conn
+    finally:
+        release_connection(conn)
+
+
+@atexit.register
+def close_pool() -> None:
+    """
+    Функция закрытия всех соединений пула
+    """
+
+    global _pool
+
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.closeall()
+    _pool = None
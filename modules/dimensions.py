@@ -0,0 +1,140 @@
+import logging
+import psycopg2
+import numpy as np
+import pandas as pd
+
+from typing import Dict, List
+
+from modules.config import parse_option
+from modules.db import connection
+from modules.schema import HITS_CATEGORIES, SESSIONS_CATEGORIES
+
+
+# Низкокардинальные колонки таблиц, хранящиеся в режиме нормализации как идентификаторы таблиц-справочников
+DIMENSIONS = {
+    'db_sessions': SESSIONS_CATEGORIES,
+    'db_hits': HITS_CATEGORIES
+}
+
+
+def normalized() -> bool:
+    """
+    Функция проверки, включен ли режим нормализации (справочники вместо строк) в конфигурационном файле
+    """
+
+    return parse_option('ddl', 'normalized', fallback='false') == 'true'
+
+
+def dimension_type() -> str:
+    """
+    Функция получения типа низкокардинальных колонок в таблицах фактов и агрегатов
+    """
+
+    return 'SMALLINT' if normalized() else 'VARCHAR(50)'
+
+
+def create_dimensions(
+        cur: psycopg2.extensions.cursor
+) -> None:
+    """
+    Функция создания таблиц-справочников
+    """
+
+    for col in sorted({col for cols in DIMENSIONS.values() for col in cols}):
+        cur.execute(f"CREATE TABLE IF NOT EXISTS dim_{col} "
+                    f"(id SMALLSERIAL PRIMARY KEY, value VARCHAR(50) NOT NULL UNIQUE)")
+
+
+def create_views(
+        cur: psycopg2.extensions.cursor
+) -> None:
+    """
+    Функция создания представлений таблиц фактов с расшифровкой идентификаторов справочников
+    """
+
+    for table, dims in DIMENSIONS.items():
+        cur.execute('''
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = %s ORDER BY ordinal_position
+        ''', (table,))
+        columns = [f'd_{col}.value AS {col}' if col in dims else f'f.{col}' for col, in cur.fetchall()]
+        joins = ' '.join(f'JOIN dim_{col} d_{col} ON d_{col}.id = f.{col}' for col in dims)
+        cur.execute(f"CREATE OR REPLACE VIEW v_{table[len('db_'):]} AS "
+                    f"SELECT {', '.join(columns)} FROM {table} f {joins}")
+
+
+class DimensionCache:
+    """
+    Класс кэша соответствия значений справочников их идентификаторам в памяти процесса
+    """
+
+    def __init__(self) -> None:
+        self.ids: Dict[str, Dict[str, int]] = {}
+
+    def reset(self) -> None:
+        self.ids = {}
+
+    def lookup(
+            self,
+            col: str,
+            values: List[str]
+    ) -> Dict[str, int]:
+        """
+        Функция получения идентификаторов значений (новые значения добавляются в справочник)
+        """
+
+        # Все значения уже в кэше - обращение к БД не требуется
+        cached = self.ids.get(col)
+        if cached is not None and all(value in cached for value in values):
+            return cached
+
+        # Справочники добавляются в отдельной транзакции: откат загрузки пакета не делает кэш устаревшим
+        with connection() as conn:
+            cur = conn.cursor()
+            if col not in self.ids:
+                cur.execute(f'SELECT value, id FROM dim_{col}')
+                self.ids[col] = dict(cur.fetchall())
+            missing = [value for value in values if value not in self.ids[col]]
+            if missing:
+                cur.execute(f'INSERT INTO dim_{col} (value) SELECT unnest(%s::text[]) ON CONFLICT (value) DO NOTHING',
+                            (missing,))
+                cur.execute(f'SELECT value, id FROM dim_{col} WHERE value = ANY(%s)', (missing,))
+                self.ids[col].update(cur.fetchall())
+                conn.commit()
+                logging.info(f" * SUCCESS *: Add {len(missing)} values to \'dim_{col}\' complete.")
+        return self.ids[col]
+
+    def encode(
+            self,
+            df: pd.DataFrame,
+            table: str
+    ) -> pd.DataFrame:
+        """
+        Функция замены значений низкокардинальных колонок идентификаторами справочников
+        """
+
+        df = df.copy()
+        for col in DIMENSIONS[table]:
+            values = df[col].astype('category').cat.remove_unused_categories()
+            if values.isna().any():
+                raise ValueError(f"Column '{col}' of '{table}' contains missing values.")
+            ids = self.lookup(col, list(values.cat.categories))
+            # Перекодировка категорий (по одному обращению к словарю на уникальное значение)
+            codes = np.array([ids[value] for value in values.cat.categories], dtype='int16')
+            df[col] = codes[values.cat.codes.to_numpy()]
+        return df
+
+
+# Кэш справочников процесса загрузки
+dimension_cache = DimensionCache()
+
+
+def encode_dimensions(
+        df: pd.DataFrame,
+        table: str
+) -> pd.DataFrame:
+    """
+    Функция перекодировки датафрейма перед загрузкой (в режиме нормализации)
+    """
+
+    return dimension_cache.encode(df, table) if normalized() else df
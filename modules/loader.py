@@ -0,0 +1,179 @@
+import io
+import logging
+import time
+import psycopg2
+import pandas as pd
+
+from typing import Dict, List, Optional
+
+from modules.aggregates import aggregates_enabled, create_aggregates, merge_with_rollup
+from modules.db import connection, is_transient, retry
+from modules.dimensions import encode_dimensions
+from modules.metrics import emit, metrics_enabled
+from modules.partitions import ensure_partitions
+from modules.schema import TABLES
+
+
+# Маркер пропуска (NULL) в csv-буфере для COPY
+NULL_MARKER = '\\N'
+
+
+def df_to_buffer(
+        df: pd.DataFrame
+) -> io.StringIO:
+    """
+    Функция сериализации датафрейма в csv-буфер в памяти для COPY
+    """
+
+    # Пропуски записываются явным маркером NULL_MARKER: пустая строка без кавычек в COPY csv читается как NULL,
+    # и пустые строковые значения колонок NOT NULL приводили бы к ошибке загрузки
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False, date_format='%Y-%m-%d', na_rep=NULL_MARKER)
+    buffer.seek(0)
+    return buffer
+
+
+def copy_from_df(
+        df: pd.DataFrame,
+        table: str,
+        cur: psycopg2.extensions.cursor
+) -> None:
+    """
+    Функция потоковой загрузки датафрейма в таблицу через COPY FROM STDIN
+    """
+
+    cols = ','.join(df.columns)
+    cur.copy_expert(f"COPY {table} ({cols}) FROM STDIN WITH (FORMAT csv, NULL '{NULL_MARKER}')", df_to_buffer(df))
+
+
+def create_staging_table(
+        table: str,
+        cur: psycopg2.extensions.cursor
+) -> str:
+    """
+    Функция создания временной промежуточной таблицы (одна на соединение, очищается при commit)
+    """
+
+    staging = f'stg_{table}'
+    cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS {staging} (LIKE {table} INCLUDING DEFAULTS) "
+                f"ON COMMIT DELETE ROWS")
+    return staging
+
+
+def parent_condition(
+        table: str
+) -> Optional[str]:
+    """
+    Функция формирования условия наличия родительской записи (полусоединение на стороне БД)
+    """
+
+    parent = TABLES[table]['parent']
+    if parent is None:
+        return None
+    parent_table, parent_key = parent
+    return f"EXISTS (SELECT 1 FROM {parent_table} p WHERE p.{parent_key} = s.{parent_key})"
+
+
+def count_orphans(
+        table: str,
+        staging: str,
+        cur: psycopg2.extensions.cursor
+) -> int:
+    """
+    Функция подсчета строк промежуточной таблицы без родительской записи
+    """
+
+    condition = parent_condition(table)
+    if condition is None:
+        return 0
+    cur.execute(f"SELECT count(*) FROM {staging} s WHERE NOT {condition}")
+    return cur.fetchone()[0]
+
+
+def merge_query(
+        table: str,
+        staging: str,
+        columns: List[str]
+) -> str:
+    """
+    Функция формирования запроса переноса строк из промежуточной таблицы в целевую
+    """
+
+    cols = ','.join(columns)
+    stg_cols = ','.join(f's.{col}' for col in columns)
+    query = f"INSERT INTO {table} ({cols}) SELECT {stg_cols} FROM {staging} s"
+
+    # Перенос только строк, для которых есть запись в родительской таблице
+    condition = parent_condition(table)
+    if condition is not None:
+        query += f" WHERE {condition}"
+
+    return query + " ON CONFLICT DO NOTHING"
+
+
+def insert_into_table(
+        df: pd.DataFrame,
+        table: str,
+        file: str,
+        cur: psycopg2.extensions.cursor,
+        conn: psycopg2.extensions.connection
+) -> Optional[Dict[str, int]]:
+    """
+    Функция импорта датафрейма в БД: COPY в промежуточную таблицу и перенос в целевую одним запросом
+    """
+
+    counts = None
+    start = time.perf_counter()
+    try:
+        staging = create_staging_table(table, cur)
+        copy_from_df(encode_dimensions(df, table), staging, cur)
+        orphans = count_orphans(table, staging, cur)
+        # Создание секций для новых дат (для несекционированной таблицы ничего не выполняется)
+        ensure_partitions(df[TABLES[table]['partition']], table, cur)
+        query = merge_query(table, staging, list(df.columns))
+        if aggregates_enabled():
+            # Агрегаты обновляются в той же транзакции только по вставленным строкам
+            create_aggregates(cur)
+            cur.execute(merge_with_rollup(table, query))
+            inserted = cur.fetchone()[0]
+        else:
+            cur.execute(query)
+            inserted = cur.rowcount
+        counts = {
+            'rows': len(df),
+            'inserted': inserted,
+            'orphans': orphans,
+            'skipped': len(df) - inserted - orphans
+        }
+        conn.commit()
+        logging.info(f" * SUCCESS *: Add data from {file.split('/')[-1]} complete "
+                     f"(inserted: {counts['inserted']}, skipped: {counts['skipped']}, "
+                     f"orphans: {counts['orphans']}).\n")
+        if metrics_enabled():
+            # Пропущенные строки - конфликты по первичному ключу (уже загруженные)
+            wall = time.perf_counter() - start
+            emit('load', file=file.split('/')[-1], table=table, wall_s=round(wall, 4),
+                 rows_per_s=round(len(df) / wall, 1), conflicts=counts['skipped'], **counts)
+
+    except Exception as e:
+        if is_transient(e):
+            # Обрыв соединения обрабатывается повтором загрузки в новом соединении (load_df)
+            raise
+        logging.error(f"{type(e).__name__}: {e} ")
+        conn.rollback()
+        counts = None
+    return counts
+
+
+@retry
+def load_df(
+        df: pd.DataFrame,
+        table: str,
+        file: str
+) -> Optional[Dict[str, int]]:
+    """
+    Функция импорта датафрейма в БД через соединение из пула с повтором при обрыве соединения
+    """
+
+    with connection() as conn:
+        return insert_into_table(df, table, file, conn.cursor(), conn)
@@ -1,10 +1,12 @@
 from preparation import data_prep
-from DDL import ddl
+from DDL import ddl, initial_load_mode
 from add_extr_data import pipeline
 
 
 def main():
-    data_prep()
+    # В потоковом режиме обработка основного датасета выполняется при загрузке в БД
+    if initial_load_mode() == 'file':
+        data_prep()
     ddl()
     pipeline()
 
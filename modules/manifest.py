@@ -0,0 +1,118 @@
+import hashlib
+import logging
+import os
+import psycopg2
+
+from typing import Dict, List, Union
+
+
+# Таблица учета загруженных файлов
+MANIFEST_SQL = '''
+    CREATE TABLE IF NOT EXISTS etl_manifest (
+        file_path TEXT NOT NULL PRIMARY KEY,
+        file_size BIGINT NOT NULL,
+        file_mtime DOUBLE PRECISION NOT NULL,
+        file_hash CHAR(64) NOT NULL,
+        loaded_at TIMESTAMP NOT NULL DEFAULT now()
+    )
+'''
+
+
+def file_hash(
+        file_path: str,
+        block_size: int = 1 << 20
+) -> str:
+    """
+    Функция вычисления sha256 содержимого файла
+    """
+
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_fingerprint(
+        file_path: str
+) -> Dict[str, Union[int, float]]:
+    """
+    Функция получения размера и времени изменения файла
+    """
+
+    stat = os.stat(file_path)
+    return {'file_size': stat.st_size, 'file_mtime': stat.st_mtime}
+
+
+def create_manifest(
+        cur: psycopg2.extensions.cursor,
+        conn: psycopg2.extensions.connection
+) -> None:
+    """
+    Функция создания таблицы учета загруженных файлов
+    """
+
+    cur.execute(MANIFEST_SQL)
+    conn.commit()
+
+
+def pending_files(
+        files: List[str],
+        cur: psycopg2.extensions.cursor,
+        conn: psycopg2.extensions.connection,
+        force: bool = False
+) -> List[str]:
+    """
+    Функция отбора новых и измененных файлов (сравнение размера, времени изменения и хэша с таблицей учета)
+    """
+
+    create_manifest(cur, conn)
+    if force:
+        logging.info(f" Forced reprocessing of {len(files)} files.")
+        return list(files)
+
+    cur.execute("SELECT file_path, file_size, file_mtime, file_hash FROM etl_manifest WHERE file_path = ANY(%s)",
+                (list(files),))
+    loaded = {row[0]: row[1:] for row in cur.fetchall()}
+
+    pending = []
+    for file in files:
+        fingerprint = file_fingerprint(file)
+        if file not in loaded:
+            pending.append(file)
+            continue
+        size, mtime, content_hash = loaded[file]
+        if (size, mtime) == (fingerprint['file_size'], fingerprint['file_mtime']):
+            continue
+        # Размер или время изменения отличаются - сравнение по содержимому
+        if file_hash(file) == content_hash:
+            cur.execute("UPDATE etl_manifest SET file_size = %s, file_mtime = %s WHERE file_path = %s",
+                        (fingerprint['file_size'], fingerprint['file_mtime'], file))
+        else:
+            pending.append(file)
+    conn.commit()
+
+    logging.info(f" {len(pending)} of {len(files)} files are new or changed.")
+    return pending
+
+
+def register_file(
+        file_path: str,
+        cur: psycopg2.extensions.cursor,
+        conn: psycopg2.extensions.connection
+) -> None:
+    """
+    Функция записи загруженного файла в таблицу учета
+    """
+
+    fingerprint = file_fingerprint(file_path)
+    cur.execute('''
+        INSERT INTO etl_manifest (file_path, file_size, file_mtime, file_hash)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (file_path) DO UPDATE SET
+            file_size = EXCLUDED.file_size,
+            file_mtime = EXCLUDED.file_mtime,
+            file_hash = EXCLUDED.file_hash,
+            loaded_at = now()
+    ''', (file_path, fingerprint['file_size'], fingerprint['file_mtime'], file_hash(file_path)))
+    conn.commit()
@@ -0,0 +1,85 @@
+import datetime as dt
+import functools
+import json
+import logging
+import os
+import resource
+import time
+import pandas as pd
+
+from typing import Callable, List
+
+from modules.config import parse_option
+
+
+def metrics_enabled() -> bool:
+    """
+    Функция проверки, включен ли сбор метрик в конфигурационном файле
+    """
+
+    return parse_option('metrics', 'enabled', fallback='false') == 'true'
+
+
+def rss_mb() -> float:
+    """
+    Функция получения текущего объема резидентной памяти процесса, МБ
+    """
+
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        # Вне Linux - пиковое значение (ru_maxrss в macOS - в байтах)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 20
+
+
+def emit(
+        event: str,
+        **fields
+) -> None:
+    """
+    Функция записи метрики: строка json в файл метрик (json lines) или в лог
+    """
+
+    record = json.dumps({'event': event, 'ts': dt.datetime.now().isoformat(), 'pid': os.getpid(), **fields},
+                        default=str)
+    metrics_file = parse_option('metrics', 'file', fallback='')
+    if metrics_file:
+        with open(metrics_file, 'a') as f:
+            f.write(record + '\n')
+    else:
+        logging.info(f" * METRICS *: {record}")
+
+
+def profile_step(
+        func: Callable[[pd.DataFrame], pd.DataFrame],
+        step: str,
+        file: str
+) -> Callable[[pd.DataFrame], pd.DataFrame]:
+    """
+    Функция-обертка шага обработки: время выполнения, строки на входе и выходе, изменение памяти
+    """
+
+    @functools.wraps(func)
+    def wrapper(df: pd.DataFrame) -> pd.DataFrame:
+        rows_in, rss, start = len(df), rss_mb(), time.perf_counter()
+        df = func(df)
+        emit('step', file=file.split('/')[-1], step=step, wall_s=round(time.perf_counter() - start, 4),
+             rows_in=rows_in, rows_out=len(df), rss_delta_mb=round(rss_mb() - rss, 1))
+        return df
+
+    return wrapper
+
+
+def instrument_steps(
+        steps: List[Callable[[pd.DataFrame], pd.DataFrame]],
+        file: str
+) -> List[Callable[[pd.DataFrame], pd.DataFrame]]:
+    """
+    Функция добавления замеров к списку шагов обработки (при включенном сборе метрик)
+    """
+
+    if not metrics_enabled():
+        return steps
+    return [profile_step(step, step.__name__, file) for step in steps]
@@ -0,0 +1,166 @@
+import io
+import os
+import logging
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+
+import modules.preparation as preparation
+
+from modules.backend import get_backend
+from modules.config import parse_option
+from modules.metrics import instrument_steps
+from modules.preparation import HashIndex, path_info, save_rejects, session_hashes, unique_mask
+from modules.profiler import FileProfile, profile_needed
+
+
+def byte_ranges(
+        file_path: str,
+        workers: int,
+        range_size: int
+) -> Tuple[bytes, List[Tuple[int, int]]]:
+    """
+    Функция разбиения csv-файла на диапазоны байт, выровненные по границам строк (не менее workers диапазонов,
+    не более range_size байт в диапазоне); поля с переводом строки внутри кавычек не поддерживаются
+    """
+
+    total = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        header = f.readline()
+        start = f.tell()
+        step = max(1, min(range_size, -(-(total - start) // workers)))
+        ranges = []
+        while start < total:
+            # Граница диапазона переносится на конец строки
+            f.seek(min(start + step, total))
+            f.readline()
+            end = min(f.tell(), total)
+            ranges.append((start, end))
+            start = end
+    return header, ranges
+
+
+def init_worker(
+        threads: int
+) -> None:
+    """
+    Функция настройки процесса-обработчика: число потоков движка polars (задается до его импорта)
+    """
+
+    os.environ.setdefault('POLARS_MAX_THREADS', str(threads))
+
+
+def prep_range(
+        file_path: str,
+        dataset: str,
+        header: bytes,
+        start: int,
+        end: int,
+        chunksize: int,
+        profiled: bool
+) -> Tuple[List[Tuple[pd.DataFrame, np.ndarray, np.ndarray]], List[Tuple[pd.DataFrame, str]], Optional[FileProfile]]:
+    """
+    Функция обработки диапазона байт csv-файла в процессе-обработчике: обработанные части без дубликатов внутри
+    диапазона с хэшами строк и session_id для объединения в родительском процессе, отклоненные строки
+    и профиль исходных строк диапазона (при profiled)
+    """
+
+    # Отклоненные строки накапливаются и записываются родительским процессом в порядке диапазонов
+    preparation.rejects_buffer = []
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    engine = get_backend()
+    steps = instrument_steps(engine.prep_steps(dataset), file_path)
+    seen = HashIndex()
+    profile = FileProfile(file_path) if profiled else None
+    chunks = []
+    for chunk in engine.read_csv(io.BytesIO(header + data), dataset, chunksize, profile):
+        for step in steps:
+            chunk = step(chunk)
+        hashes = engine.row_hashes(chunk)
+        mask = unique_mask(hashes, seen)
+        df = engine.to_pandas(engine.take(chunk, mask))
+        chunks.append((df, hashes[mask], session_hashes(df)))
+
+    rejects, preparation.rejects_buffer = preparation.rejects_buffer, None
+    return chunks, rejects, profile
+
+
+def iter_prep_parallel(
+        workers: int
+) -> Iterator[Tuple[str, pd.DataFrame]]:
+    """
+    Функция параллельной обработки основной выгрузки по диапазонам байт в пуле процессов: диапазоны sessions и hits
+    обрабатываются одновременно, результаты объединяются строго в порядке файлов с удалением дубликатов между
+    диапазонами и строк hits без сессий
+    """
+
+    chunksize = int(parse_option('preparation', 'chunksize', fallback='0'))
+    range_size = int(parse_option('preparation', 'range_mb', fallback='64')) << 20
+
+    # Профили исходных файлов строятся по диапазонам в том же проходе и объединяются в порядке диапазонов
+    tasks = []
+    profiles = {}
+    for dataset in ('sessions', 'hits'):
+        file_path = f'{path_info}/data/main_data/ga_{dataset}.csv'
+        header, ranges = byte_ranges(file_path, workers, range_size)
+        if profile_needed(file_path):
+            profiles[dataset] = FileProfile(file_path)
+        tasks += [(file_path, dataset, header, start, end, chunksize, dataset in profiles) for start, end in ranges]
+    logging.info(f" Parallel preparation: {len(tasks)} ranges, {workers} workers.")
+
+    start_method = get_backend().start_method
+    mp_context = multiprocessing.get_context(start_method) if start_method else None
+    # Ядра делятся между процессами-обработчиками (если число потоков polars не задано явно)
+    threads = int(parse_option('backend', 'threads', fallback='0')) or max(1, os.cpu_count() // workers)
+
+    seen = {'sessions': HashIndex(), 'hits': HashIndex()}
+    rows = {'sessions': 0, 'hits': 0}
+    sessions = HashIndex()
+    orphans = 0
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context, initializer=init_worker,
+                             initargs=(threads,)) as executor:
+        # Ограниченное окно задач: обработчики опережают объединение не более чем на 2 * workers диапазонов
+        window = deque()
+        pending = iter(tasks)
+        for task in pending:
+            window.append((task[1], executor.submit(prep_range, *task)))
+            if len(window) >= 2 * workers:
+                break
+
+        while window:
+            dataset, future = window.popleft()
+            chunks, rejects, profile = future.result()
+            task = next(pending, None)
+            if task is not None:
+                window.append((task[1], executor.submit(prep_range, *task)))
+
+            if profile is not None:
+                profiles[dataset].merge(profile)
+            for df, dataset_rejected in rejects:
+                save_rejects(df, dataset_rejected)
+            for df, hashes, sids in chunks:
+                # Строки, уже встречавшиеся в предыдущих диапазонах
+                mask = ~seen[dataset].contains(hashes)
+                seen[dataset].add(hashes[mask])
+                if dataset == 'sessions':
+                    sessions.add(sids[mask])
+                else:
+                    # Строки hits, session_id которых отсутствует в sessions (все диапазоны sessions уже объединены)
+                    parent = sessions.contains(sids[mask])
+                    orphans += int((~parent).sum())
+                    mask[mask] = parent
+                rows[dataset] += int(mask.sum())
+                yield dataset, df[mask]
+
+    for profile in profiles.values():
+        profile.save()
+    for dataset in ('sessions', 'hits'):
+        logging.info(f" * SUCCESS *: Preparation data \'ga_{dataset}\' complete ({rows[dataset]} rows).")
+    logging.info(f" * SUCCESS *: Drop {orphans} orphan rows of \'hits\' complete.")
@@ -0,0 +1,133 @@
+import logging
+import psycopg2
+import pandas as pd
+
+from typing import List, Optional
+
+from modules.config import parse_option
+from modules.schema import TABLES
+
+
+def partition_key(
+        table: str
+) -> Optional[str]:
+    """
+    Функция получения колонки секционирования таблицы (None, если секционирование отключено в конфигурации)
+    """
+
+    dataset = table[len('db_'):]
+    if parse_option('ddl', f'partition_{dataset}', fallback='false') != 'true':
+        return None
+    return TABLES[table]['partition']
+
+
+def primary_key(
+        table: str
+) -> List[str]:
+    """
+    Функция получения колонок первичного ключа таблицы (ключ секционированной таблицы включает колонку секционирования)
+    """
+
+    key = partition_key(table)
+    return TABLES[table]['key'] + ([key] if key is not None else [])
+
+
+def partition_clause(
+        table: str
+) -> str:
+    """
+    Функция формирования условия секционирования для запроса создания таблицы
+    """
+
+    key = partition_key(table)
+    return f'PARTITION BY RANGE ({key})' if key is not None else ''
+
+
+def partition_name(
+        table: str,
+        month: pd.Period
+) -> str:
+    """
+    Функция формирования имени месячной секции таблицы
+    """
+
+    return f'{table}_p{month.year}_{month.month:02d}'
+
+
+def list_partitions(
+        table: str,
+        cur: psycopg2.extensions.cursor
+) -> List[str]:
+    """
+    Функция получения имен секций таблицы (пустой список для несекционированной таблицы)
+    """
+
+    cur.execute('''
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+    ''', (table,))
+    return sorted(row[0] for row in cur.fetchall())
+
+
+def is_partitioned(
+        table: str,
+        cur: psycopg2.extensions.cursor
+) -> bool:
+    """
+    Функция проверки, является ли таблица секционированной
+    """
+
+    cur.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    row = cur.fetchone()
+    return bool(row and row[0])
+
+
+def ensure_partitions(
+        dates: pd.Series,
+        table: str,
+        cur: psycopg2.extensions.cursor
+) -> List[str]:
+    """
+    Функция создания недостающих месячных секций таблицы для дат загружаемых данных
+    """
+
+    if not is_partitioned(table, cur):
+        return []
+
+    existing = set(list_partitions(table, cur))
+    created = []
+    for month in sorted(pd.to_datetime(dates).dropna().dt.to_period('M').unique()):
+        name = partition_name(table, month)
+        if name in existing:
+            continue
+        start, end = month.start_time.date(), (month + 1).start_time.date()
+        cur.execute(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} FOR VALUES FROM ('{start}') TO ('{end}')")
+        created.append(name)
+
+    if created:
+        logging.info(f" * SUCCESS *: Create partitions {created} of \'{table}\' complete.")
+    return created
+
+
+def detach_partitions(
+        table: str,
+        before: str,
+        cur: psycopg2.extensions.cursor,
+        conn: psycopg2.extensions.connection
+) -> List[str]:
+    """
+    Функция отсоединения месячных секций таблицы с данными ранее указанного месяца (для архивации или удаления)
+    """
+
+    before = pd.Period(before, freq='M')
+    detached = []
+    for name in list_partitions(table, cur):
+        year, month = name[len(f'{table}_p'):].split('_')
+        if pd.Period(year=int(year), month=int(month), freq='M') < before:
+            cur.execute(f'ALTER TABLE {table} DETACH PARTITION {name}')
+            detached.append(name)
+    conn.commit()
+
+    logging.info(f" * SUCCESS *: Detach partitions {detached} of \'{table}\' complete.")
+    return detached
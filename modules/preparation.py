@@ -1,144 +1,283 @@
+import numpy as np
 import pandas as pd
 import logging
+import os
+import shutil
 
-from datetime import datetime
-from modules.DDL import parse_ini
+from typing import Iterator, Optional, Tuple
+from modules.backend import get_backend
+from modules.config import parse_ini, parse_option
+from modules.metrics import instrument_steps
+from modules.partitions import partition_key
+from modules.profiler import FileProfile, profile_needed
+from modules.schema import SCHEMA, TRANSFORMS
 
 
 logging.basicConfig(level=logging.INFO)
 path_info, _ = parse_ini() # Считываем путь к проекту из конфигурационного файла
 
+# Отклоненные строки, накапливаемые процессом-обработчиком для записи родительским процессом (None - запись сразу)
+rejects_buffer = None
 
-def missing_values(
+
+class HashIndex:
+    """
+    Компактный индекс 64-битных хэшей (отсортированный numpy-массив) для поиска повторов между чанками
+    """
+
+    def __init__(self) -> None:
+        self.hashes = np.empty(0, dtype='uint64')
+
+    def contains(
+            self,
+            hashes: np.ndarray
+    ) -> np.ndarray:
+        """
+        Метод проверки наличия хэшей в индексе
+        """
+
+        if len(self.hashes) == 0:
+            return np.zeros(len(hashes), dtype=bool)
+        pos = np.minimum(np.searchsorted(self.hashes, hashes), len(self.hashes) - 1)
+        return self.hashes[pos] == hashes
+
+    def add(
+            self,
+            hashes: np.ndarray
+    ) -> None:
+        """
+        Метод добавления хэшей в индекс
+        """
+
+        self.hashes = np.union1d(self.hashes, hashes)
+
+
+def unique_mask(
+        hashes: np.ndarray,
+        seen: HashIndex
+) -> np.ndarray:
+    """
+    Функция построения маски первых вхождений хэшей строк, отсутствующих в индексе, с добавлением их в индекс
+    """
+
+    mask = ~pd.Series(hashes).duplicated().to_numpy() & ~seen.contains(hashes)
+    seen.add(hashes[mask])
+    return mask
+
+
+def drop_duplicates_chunk(
+        df: pd.DataFrame,
+        seen: HashIndex,
+        backend: Optional[str] = 'pandas'
+) -> pd.DataFrame:
+    """
+    Функция удаления дубликатов в чанке, в том числе строк, уже встречавшихся в предыдущих чанках
+    """
+
+    engine = get_backend(backend)
+    return engine.take(df, unique_mask(engine.row_hashes(df), seen))
+
+
+def session_hashes(
         df: pd.DataFrame
-) -> pd.Series:
+) -> np.ndarray:
     """
-    Функция поиска пропущенных значений в процентах для каждого признака в датафрейме
+    Функция вычисления 64-битных хэшей session_id
     """
 
-    miss_values = None
-    if df is not None:
-        miss_values = (df.isna().sum() / len(df) * 100).sort_values(ascending=False)
-    return miss_values
+    return pd.util.hash_array(df['session_id'].to_numpy(dtype=object))
 
 
 def save_to_csv(
         df: pd.DataFrame,
-        file_name: str
+        file_name: str,
+        mode: str = 'w',
+        header: bool = True
 ) -> None:
     """
     Функция сохранения датафрейма в файл csv
     """
 
     try:
-        df.to_csv(f'{path_info}/data/prep_data/{file_name}.csv', index=False)
+        df.to_csv(f'{path_info}/data/prep_data/{file_name}.csv', index=False, mode=mode, header=header)
         logging.info(f" * SUCCESS *: Save data \'{file_name}.csv\' to \'{path_info}/data/prep_data\' complete.")
     except Exception as e:
         logging.error(f"{type(e).__name__}: '{e}' occurred.")
 
 
-def filter_data_sessions(
-        df: pd.DataFrame
-) -> pd.DataFrame:
+def save_to_parquet(
+        df: pd.DataFrame,
+        file_name: str,
+        part: int = 0
+) -> None:
     """
-    Функция удаления колонок в sessions с процентом пропущенных значений более 20
+    Функция сохранения датафрейма в сжатый parquet-файл (часть part набора {file_name}.parquet); ошибка записи
+    передается дальше: неполный набор не должен быть загружен
     """
 
-    columns_to_drop = [
-        'device_model',
-        'utm_keyword',
-        'device_os'
-    ]
-    df = df.drop(columns_to_drop, axis=1)
-    return df
+    parts_dir = f'{path_info}/data/prep_data/{file_name}.parquet'
+    try:
+        # Первая часть перезаписывает набор целиком
+        if part == 0 and os.path.isdir(parts_dir):
+            shutil.rmtree(parts_dir)
+        os.makedirs(parts_dir, exist_ok=True)
+        df.to_parquet(f'{parts_dir}/part-{part:05d}.parquet', index=False, compression='zstd')
+        logging.info(f" * SUCCESS *: Save data \'{file_name}.parquet\' (part {part}) "
+                     f"to \'{path_info}/data/prep_data\' complete.")
+    except Exception as e:
+        logging.error(f"{type(e).__name__}: '{e}' occurred.")
+        raise
 
 
-def filter_data_hits(
-        df: pd.DataFrame
-) -> pd.DataFrame:
+def save_rejects(
+        df: pd.DataFrame,
+        dataset: str,
+        source: Optional[str] = None
+) -> None:
     """
-    Функция удаления колонок в hits с процентом пропущенных значений более 20
+    Функция дозаписи отклоненных строк в файл csv датасета (или исходного файла source: файлы дополнительных
+    выгрузок обрабатываются параллельно в разных процессах)
     """
 
-    columns_to_drop = [
-        'event_value',
-        'hit_time',
-        'hit_referer',
-        'event_label',
-        'hit_type'
-    ]
-    df = df.drop(columns_to_drop, axis=1)
-    return df
+    if rejects_buffer is not None:
+        rejects_buffer.append((df, dataset))
+        return
+
+    rejects_dir = f'{path_info}/data/rejects'
+    rejects_path = f'{rejects_dir}/{source or dataset}_rejects.csv'
+    try:
+        os.makedirs(rejects_dir, exist_ok=True)
+        df.to_csv(rejects_path, index=False, mode='a', header=not os.path.isfile(rejects_path))
+        logging.warning(f" {len(df)} rows of \'{dataset}\' rejected, saved to \'{rejects_path}\'.")
+    except Exception as e:
+        logging.error(f"{type(e).__name__}: '{e}' occurred.")
 
 
-def fill_cat_col_sessions(
-        df: pd.DataFrame
+def parse_unique(
+        col: pd.Series,
+        fmt: str
+) -> pd.Series:
+    """
+    Функция разбора колонки дат или времени по уникальным значениям (значения многократно повторяются)
+    с раскладкой результата по строкам; время возвращается строкой 'ЧЧ:ММ:СС'
+    """
+
+    if pd.api.types.is_datetime64_any_dtype(col):
+        # Даты уже разобраны при чтении csv
+        return col
+
+    codes, uniques = pd.factorize(col)
+    values = pd.to_datetime(pd.Series(uniques, dtype=object), format=fmt, errors='coerce')
+    if fmt == '%H:%M:%S':
+        values = values.dt.time.astype('str').where(values.notna(), None)
+
+    # Код -1 (пропуск) указывает на последний, пустой элемент
+    values = pd.concat([values, pd.Series([None], dtype=values.dtype)], ignore_index=True)
+    return pd.Series(values.to_numpy()[codes], index=col.index)
+
+
+def parse_datetime_cols(
+        df: pd.DataFrame,
+        dataset: str
 ) -> pd.DataFrame:
     """
-    Функция заполнения пропусков категориальных признаков в sessions
-    """
-
-    col = [
-        'utm_source',
-        'utm_medium',
-        'utm_campaign',
-        'utm_adcontent',
-        'device_category',
-        'device_brand',
-        'device_screen_resolution',
-        'device_browser',
-        'geo_country',
-        'geo_city'
-    ]
-    for i in col:
-        df[i] = df[i].fillna('other')
+    Функция векторного разбора колонок дат и времени по фиксированному формату с отбором некорректных строк
+    """
+
+    # Колонка секционирования таблицы обязательна (NOT NULL в БД)
+    key = partition_key(f'db_{dataset}')
+
+    parsed = {}
+    reasons = pd.Series('', index=df.index)
+    for col, (fmt, required) in SCHEMA[dataset]['formats'].items():
+        required = required or col == key
+        parsed[col] = parse_unique(df[col], fmt)
+        # Некорректное значение или пропуск в обязательной колонке
+        bad = parsed[col].isna() & (df[col].notna() | required)
+        reasons[bad] = reasons[bad] + f'{col};'
+
+    rejected = reasons != ''
+    if rejected.any():
+        save_rejects(df[rejected].assign(reject_reason=reasons[rejected].str.rstrip(';')), dataset)
+        df = df[~rejected].copy()
+
+    for col in SCHEMA[dataset]['formats']:
+        df[col] = parsed[col][~rejected]
     return df
 
 
-def fill_cat_col_hits(
-        df: pd.DataFrame
+def fill_na(
+        col: pd.Series,
+        value: str
+) -> pd.Series:
+    """
+    Функция заполнения пропусков в колонке, в том числе категориальной
+    """
+
+    if isinstance(col.dtype, pd.CategoricalDtype) and value not in col.cat.categories:
+        col = col.cat.add_categories(value)
+    return col.fillna(value)
+
+
+def apply_spec(
+        df: pd.DataFrame,
+        dataset: str
 ) -> pd.DataFrame:
     """
-    Функция заполнения пропусков категориальных признаков в hits
+    Функция обработки датафрейма по спецификации датасета за один проход по колонкам: удаление колонок,
+    удаление строк с пропусками в обязательных колонках (одна общая маска), заполнение пропусков и приведение типов
     """
 
-    col = [
-        'hit_page_path',
-        'event_category',
-        'event_action'
-    ]
-    for i in col:
-        df[i] = df[i].fillna('other')
+    spec = TRANSFORMS[dataset]
+
+    # Общая маска строк без пропусков во всех обязательных колонках
+    keep = np.ones(len(df), dtype=bool)
+    for col in spec['required']:
+        keep &= df[col].notna().to_numpy()
+    keep = None if keep.all() else keep
+
+    # Сборка результата из колонок исходного датафрейма без промежуточных копий всего датафрейма
+    columns = {}
+    for col in df.columns:
+        if col in spec['drop']:
+            continue
+        values = df[col] if keep is None else df[col][keep]
+        if col in spec['fill']:
+            values = fill_na(values, spec['fill'][col])
+        elif col in spec['types']:
+            values = values.astype(spec['types'][col])
+        columns[col] = values
+    df = pd.DataFrame(columns, copy=False)
+
+    # Разбор дат и времени с отбором некорректных строк
+    df = parse_datetime_cols(df, dataset)
+
+    # Приведение к строке колонок object, кроме строковых колонок схемы без пропусков (уже строки)
+    str_cols = {col for col, dtype in SCHEMA[dataset]['dtypes'].items() if dtype == 'str'}
+    for col in df.columns[df.dtypes == 'object']:
+        if col not in str_cols or df[col].hasnans:
+            df[col] = df[col].astype('str')
     return df
 
 
-def corr_types_sessions(
+def prep_sessions_spec(
         df: pd.DataFrame
 ) -> pd.DataFrame:
     """
-    Функция приведения типов в sessions
+    Функция обработки sessions по спецификации
     """
 
-    df['visit_number'] = df['visit_number'].astype('int64')
-    df['visit_date'] = pd.to_datetime(df['visit_date'])
-    df['visit_time'] = df['visit_time'].apply(lambda x: datetime.strptime(x, '%H:%M:%S').time())
-    obj_types = df.dtypes[df.dtypes == 'object'].index.to_list()
-    df[obj_types] = df[obj_types].astype('str')
-    return df
+    return apply_spec(df, 'sessions')
 
 
-def corr_types_hits(
+def prep_hits_spec(
         df: pd.DataFrame
 ) -> pd.DataFrame:
     """
-    Функция приведения типов в hits
+    Функция обработки hits по спецификации
     """
 
-    df['hit_number'] = df['hit_number'].astype('int64')
-    df['hit_date'] = pd.to_datetime(df.hit_date)
-    obj_types = df.dtypes[df.dtypes == 'object'].index.to_list()
-    df[obj_types] = df[obj_types].astype('str')
-    return df
+    return apply_spec(df, 'hits')
 
 
 def prep_sessions(
@@ -151,14 +290,8 @@ def prep_sessions(
 
     if df_sessions is not None:
         try:
-            # Удаление колонок с процентом пропущенных значений более 20
-            df_sessions = filter_data_sessions(df_sessions)
-
-            # Заполнение пропусков категориальных признаков
-            df_sessions = fill_cat_col_sessions(df_sessions)
-
-            # Приведение типов
-            df_sessions = corr_types_sessions(df_sessions)
+            # Удаление колонок, заполнение пропусков и приведение типов по спецификации
+            df_sessions = prep_sessions_spec(df_sessions)
 
             # Удаление дубикатов
             df_sessions = df_sessions.drop_duplicates()
@@ -181,15 +314,8 @@ def prep_hits(
 
     if df_hits is not None:
         try:
-            # Удаление колонок с процентом пропущенных значений более 20 и неинформативной колонки 'hit_type'
-            # с единственным значением
-            df_hits = filter_data_hits(df_hits)
-
-            # Заполнение пропусков категориальных признаков
-            df_hits = fill_cat_col_hits(df_hits)
-
-            # Приведение типов
-            df_hits = corr_types_hits(df_hits)
+            # Удаление колонок, заполнение пропусков и приведение типов по спецификации
+            df_hits = prep_hits_spec(df_hits)
 
             # Удаление дубикатов
             df_hits = df_hits.drop_duplicates()
@@ -201,6 +327,96 @@ def prep_hits(
         logging.info(f" Dataframe \'{path.split('/')[-1].split('.')[0]}\' is empty.")
     return df_hits
 
+
+def iter_prep_chunks(
+        path: str,
+        dataset: str,
+        chunksize: int,
+        backend: Optional[str] = None,
+        profile: Optional[FileProfile] = None
+) -> Iterator[pd.DataFrame]:
+    """
+    Функция потоковой обработки csv-файла по чанкам движком обработки (по умолчанию - из конфигурационного файла)
+    с удалением дубликатов между чанками и профилированием исходных строк в том же проходе
+    """
+
+    engine = get_backend(backend)
+    steps = instrument_steps(engine.prep_steps(dataset), path)
+    seen = HashIndex()
+    for chunk in engine.read_csv(path, dataset, chunksize, profile):
+        for step in steps:
+            chunk = step(chunk)
+        yield engine.to_pandas(drop_duplicates_chunk(chunk, seen, engine.name))
+
+
+# Шаги обработки датасетов основной и дополнительных выгрузок
+PREP_STEPS = {
+    'sessions': [prep_sessions_spec],
+    'hits': [prep_hits_spec]
+}
+
+
+def iter_prep_data(
+        dataset: str
+) -> Iterator[pd.DataFrame]:
+    """
+    Функция обработки датасета основной выгрузки с выдачей обработанных частей (потоково при chunksize > 0)
+    """
+
+    path = f'{path_info}/data/main_data/ga_{dataset}.csv'
+
+    # Размер чанка для потоковой обработки (0 - обработка целиком в памяти)
+    chunksize = int(parse_option('preparation', 'chunksize', fallback='0'))
+
+    # Профиль исходного файла для проверки перед загрузкой строится в проходе обработки (сохраняется в кэш)
+    profile = FileProfile(path) if profile_needed(path) else None
+
+    if chunksize <= 0 and get_backend().name == 'pandas':
+        prep = prep_sessions if dataset == 'sessions' else prep_hits
+        df = next(get_backend().read_csv(path, dataset, chunksize, profile))
+        if profile is not None:
+            profile.save()
+        yield prep(df, path)
+        return
+
+    # Обработка движком из конфигурационного файла (polars при chunksize <= 0 читает файл одним чанком)
+    rows = 0
+    for chunk in iter_prep_chunks(path, dataset, chunksize, profile=profile):
+        rows += len(chunk)
+        yield chunk
+    if profile is not None:
+        profile.save()
+    logging.info(f" * SUCCESS *: Preparation data \'{path.split('/')[-1].split('.')[0]}\' complete ({rows} rows).")
+
+
+def iter_prep_main() -> Iterator[Tuple[str, pd.DataFrame]]:
+    """
+    Функция обработки основной выгрузки: выдача обработанных частей sessions, затем hits без строк-сирот
+    """
+
+    # Параллельная обработка по диапазонам байт в пуле процессов
+    workers = int(parse_option('preparation', 'workers', fallback='1'))
+    if workers > 1:
+        # Отложенный импорт: модуль parallel сам импортирует preparation
+        from modules.parallel import iter_prep_parallel
+        yield from iter_prep_parallel(workers)
+        return
+
+    # Компактный индекс хэшей session_id обработанных sessions
+    sessions = HashIndex()
+    for df in iter_prep_data('sessions'):
+        sessions.add(session_hashes(df))
+        yield 'sessions', df
+
+    # Удаление строк hits, session_id которых отсутствует в sessions, до записи и загрузки в БД
+    orphans = 0
+    for df in iter_prep_data('hits'):
+        mask = sessions.contains(session_hashes(df))
+        orphans += int((~mask).sum())
+        yield 'hits', df[mask]
+    logging.info(f" * SUCCESS *: Drop {orphans} orphan rows of \'hits\' complete.")
+
+
 def data_prep() -> None:
     """
     Главная функция
@@ -208,18 +424,15 @@ def data_prep() -> None:
 
     logging.info('\n-------------------Data preparation-------------------\n')
 
-    path_sessions = f'{path_info}/data/main_data/ga_sessions.csv'
-    path_hits = f'{path_info}/data/main_data/ga_hits.csv'
-
-    # Обработка sessions
-    df_sessions = pd.read_csv(path_sessions)
-    df_sessions = prep_sessions(df_sessions, path_sessions)
-    save_to_csv(df_sessions, 'ga_sessions_prep')
-
-    # Обработка hits
-    df_hits = pd.read_csv(path_hits)
-    df_hits = prep_hits(df_hits, path_hits)
-    save_to_csv(df_hits, 'ga_hits_prep')
+    # Обработка sessions и hits с сохранением обработанных частей в csv
+    saved = set()
+    try:
+        for dataset, df in iter_prep_main():
+            first = dataset not in saved
+            save_to_csv(df, f'ga_{dataset}_prep', mode='w' if first else 'a', header=first)
+            saved.add(dataset)
+    except Exception as e:
+        logging.error(f"{type(e).__name__}: '{e}' occurred.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,340 @@
+import os
+import sys
+import json
+import logging
+import numpy as np
+import pandas as pd
+
+from typing import Dict, Iterator, List, Optional
+
+from modules.config import parse_ini, parse_option
+from modules.manifest import file_fingerprint
+from modules.schema import COLUMN_LIMITS, SCHEMA, TRANSFORMS, dataset_of
+
+
+path_info, _ = parse_ini()
+
+# Размер KMV-скетча (k минимальных хэшей) для оценки числа различных значений, погрешность ~ 1/sqrt(k)
+KMV_SIZE = 1024
+
+
+class ColumnProfile:
+    """
+    Накопитель статистик колонки за один проход по чанкам с ограниченной памятью: число непустых значений,
+    минимум и максимум, максимальная длина строки и KMV-скетч хэшей значений
+    """
+
+    def __init__(self) -> None:
+        self.values = 0
+        self.min = None
+        self.max = None
+        self.max_len = 0
+        self.sketch = np.empty(0, dtype='uint64')
+
+    def update(
+            self,
+            col: pd.Series,
+            numeric: bool = False
+    ) -> None:
+        """
+        Метод добавления чанка колонки (статистики считаются по уникальным значениям чанка)
+        """
+
+        values = col.dropna()
+        self.values += len(values)
+        uniques = pd.Series(values.unique(), dtype=object)
+        if len(uniques) == 0:
+            return
+
+        strings = uniques.astype(str)
+        self.max_len = max(self.max_len, int(strings.str.len().max()))
+
+        # Числовые колонки сравниваются как числа (некорректные значения не учитываются), остальные - как строки
+        bounds = pd.to_numeric(uniques, errors='coerce').dropna() if numeric else strings
+        if len(bounds):
+            low, high = bounds.min(), bounds.max()
+            if numeric:
+                # Целые значения (в том числе прочитанные как float из-за пропусков) сохраняются как int
+                low, high = (int(x) if float(x).is_integer() else x.item() for x in (low, high))
+            self.min = low if self.min is None else min(self.min, low)
+            self.max = high if self.max is None else max(self.max, high)
+
+        # В скетче остаются k минимальных хэшей
+        hashes = pd.util.hash_array(strings.to_numpy(dtype=object))
+        if len(hashes) > KMV_SIZE:
+            hashes = np.partition(hashes, KMV_SIZE - 1)[:KMV_SIZE]
+        self.sketch = np.union1d(self.sketch, hashes)[:KMV_SIZE]
+
+    def merge(
+            self,
+            other: 'ColumnProfile'
+    ) -> None:
+        """
+        Метод объединения со статистиками той же колонки, накопленными по другой части файла
+        """
+
+        self.values += other.values
+        self.max_len = max(self.max_len, other.max_len)
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        self.sketch = np.union1d(self.sketch, other.sketch)[:KMV_SIZE]
+
+    def distinct(self) -> int:
+        """
+        Метод оценки числа различных значений (точное значение, если их меньше размера скетча)
+        """
+
+        if len(self.sketch) < KMV_SIZE:
+            return len(self.sketch)
+        return int(round((KMV_SIZE - 1) * 2 ** 64 / (int(self.sketch[-1]) + 1)))
+
+    def to_dict(
+            self,
+            rows: int
+    ) -> Dict:
+        """
+        Метод формирования статистик колонки (пропуски - строки без значения, в том числе без ключа в json)
+        """
+
+        nulls = rows - self.values
+        return {
+            'nulls': nulls,
+            'null_pct': round(nulls / rows * 100, 2) if rows else 0.0,
+            'distinct': self.distinct(),
+            'min': self.min,
+            'max': self.max,
+            'max_len': self.max_len
+        }
+
+
+def iter_raw_chunks(
+        file_path: str,
+        chunksize: int
+) -> Iterator[pd.DataFrame]:
+    """
+    Функция чтения исходного csv- или json-файла по чанкам без приведения типов
+    """
+
+    if not file_path.endswith('.json'):
+        yield from pd.read_csv(file_path, dtype=str, chunksize=chunksize)
+        return
+
+    # Отложенный импорт: модуль add_extr_data сам импортирует profiler
+    from modules.add_extr_data import iter_json_records
+    batch = []
+    for record in iter_json_records(file_path):
+        batch.append(record)
+        if len(batch) == chunksize:
+            yield pd.DataFrame(batch)
+            batch = []
+    if batch:
+        yield pd.DataFrame(batch)
+
+
+def profile_path(
+        file_path: str
+) -> str:
+    """
+    Функция получения пути к файлу профиля исходного файла
+    """
+
+    return f"{path_info}/data/profiles/{file_path.split('/')[-1].rsplit('.', 1)[0]}.json"
+
+
+def load_profile(
+        file_path: str
+) -> Optional[Dict]:
+    """
+    Функция чтения сохраненного профиля файла (None - профиля нет или файл изменился)
+    """
+
+    try:
+        with open(profile_path(file_path), 'r') as f:
+            profile = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return profile if profile.get('fingerprint') == file_fingerprint(file_path) else None
+
+
+class FileProfile:
+    """
+    Накопитель профиля исходного файла по чанкам исходных записей (в том числе в проходе обработки файла)
+    """
+
+    def __init__(
+            self,
+            file_path: str
+    ) -> None:
+        self.file_path = file_path
+        self.numeric = {col for col, dtype in SCHEMA[dataset_of(file_path)]['dtypes'].items() if dtype == 'Int16'}
+        self.rows = 0
+        self.columns = {}
+
+    def update(
+            self,
+            df: pd.DataFrame
+    ) -> None:
+        """
+        Метод добавления чанка исходных записей
+        """
+
+        self.rows += len(df)
+        for col in df.columns:
+            self.columns.setdefault(col, ColumnProfile()).update(df[col], col in self.numeric)
+
+    def merge(
+            self,
+            other: 'FileProfile'
+    ) -> None:
+        """
+        Метод объединения с профилем другой части файла (части объединяются в порядке следования в файле)
+        """
+
+        self.rows += other.rows
+        for col, stats in other.columns.items():
+            if col in self.columns:
+                self.columns[col].merge(stats)
+            else:
+                self.columns[col] = stats
+
+    def save(self) -> Dict:
+        """
+        Метод формирования профиля и сохранения его в кэш профилей
+        """
+
+        profile = {
+            'file': self.file_path.split('/')[-1],
+            'fingerprint': file_fingerprint(self.file_path),
+            'rows': self.rows,
+            'columns': {col: stats.to_dict(self.rows) for col, stats in self.columns.items()}
+        }
+
+        try:
+            os.makedirs(f'{path_info}/data/profiles', exist_ok=True)
+            with open(profile_path(self.file_path), 'w') as f:
+                json.dump(profile, f, ensure_ascii=False, indent=2)
+            logging.info(f" * SUCCESS *: Profile of \'{profile['file']}\' saved ({self.rows} rows).")
+        except Exception as e:
+            logging.error(f"{type(e).__name__}: '{e}' occurred.")
+        return profile
+
+
+def drift_check_enabled() -> bool:
+    """
+    Функция проверки, включена ли проверка исходных файлов по профилю
+    """
+
+    return parse_option('profiler', 'drift_check', fallback='true') == 'true'
+
+
+def profile_needed(
+        file_path: str
+) -> bool:
+    """
+    Функция проверки, нужно ли строить профиль файла (проверка включена, сохраненного актуального профиля нет)
+    """
+
+    return drift_check_enabled() and load_profile(file_path) is None
+
+
+def profile_file(
+        file_path: str
+) -> Dict:
+    """
+    Функция профилирования исходного файла за один проход по чанкам: доля пропусков, оценка числа различных значений,
+    минимум и максимум, максимальная длина строки по колонкам; профиль кэшируется по размеру и времени изменения файла
+    """
+
+    profile = load_profile(file_path)
+    if profile is not None:
+        return profile
+
+    chunksize = int(parse_option('profiler', 'chunksize', fallback='500000'))
+    accumulator = FileProfile(file_path)
+    for df in iter_raw_chunks(file_path, chunksize):
+        accumulator.update(df)
+    return accumulator.save()
+
+
+def schema_drift(
+        profile: Dict,
+        dataset: str
+) -> List[str]:
+    """
+    Функция поиска несоответствий профиля файла схеме БД: отсутствующие обязательные колонки, строки длиннее VARCHAR,
+    значения вне диапазона SMALLINT
+    """
+
+    # Пустой файл (без записей) не противоречит схеме БД
+    if profile['rows'] == 0:
+        return []
+
+    columns = profile['columns']
+    problems = [f"required column '{col}' is missing" for col in TRANSFORMS[dataset]['required']
+                if col not in columns]
+
+    for col, limits in COLUMN_LIMITS[dataset].items():
+        stats = columns.get(col)
+        if stats is None:
+            continue
+        if 'max_len' in limits and stats['max_len'] > limits['max_len']:
+            problems.append(f"column '{col}' has values of length {stats['max_len']} "
+                            f"(VARCHAR({limits['max_len']}))")
+        if 'range' in limits and stats['min'] is not None:
+            low, high = limits['range']
+            if stats['min'] < low or stats['max'] > high:
+                problems.append(f"column '{col}' has values in [{stats['min']}, {stats['max']}] "
+                                f"out of range [{low}, {high}]")
+    return problems
+
+
+def high_null_columns(
+        profile: Dict,
+        dataset: str,
+        threshold: float
+) -> List[str]:
+    """
+    Функция поиска колонок с долей пропусков выше порога, которые не удаляются и не заполняются при обработке
+    """
+
+    spec = TRANSFORMS[dataset]
+    return [col for col, stats in profile['columns'].items()
+            if stats['null_pct'] > threshold and col not in spec['drop'] and col not in spec['fill']]
+
+
+def check_drift(
+        file_path: str
+) -> bool:
+    """
+    Функция проверки исходного файла по профилю перед загрузкой (False - файл не соответствует схеме БД)
+    """
+
+    if not drift_check_enabled():
+        return True
+
+    name = file_path.split('/')[-1]
+    dataset = dataset_of(file_path)
+    try:
+        profile = profile_file(file_path)
+    except Exception as e:
+        # Ошибка профилирования не блокирует загрузку: ошибки чтения проявятся при обработке
+        logging.error(f"{type(e).__name__}: '{e}' occurred.")
+        return True
+
+    threshold = float(parse_option('profiler', 'null_threshold', fallback='20'))
+    for col in high_null_columns(profile, dataset, threshold):
+        logging.warning(f" Column \'{col}\' of \'{name}\' has {profile['columns'][col]['null_pct']}% "
+                        f"missing values (threshold {threshold}%).")
+
+    problems = schema_drift(profile, dataset)
+    for problem in problems:
+        logging.error(f" Schema drift in \'{name}\': {problem}.")
+    return not problems
+
+
+if __name__ == "__main__":
+    # Профилирование файлов из аргументов (по умолчанию - основной выгрузки)
+    files = sys.argv[1:] or [f'{path_info}/data/main_data/ga_{dataset}.csv' for dataset in ('sessions', 'hits')]
+    for file in files:
+        print(json.dumps(profile_file(file), ensure_ascii=False, indent=2))
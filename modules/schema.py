@@ -0,0 +1,151 @@
+import pandas as pd
+
+from typing import Dict
+
+
+# Низкокардинальные категориальные колонки в sessions
+SESSIONS_CATEGORIES = [
+    'utm_source',
+    'utm_medium',
+    'utm_campaign',
+    'utm_adcontent',
+    'device_category',
+    'device_brand',
+    'device_screen_resolution',
+    'device_browser',
+    'geo_country',
+    'geo_city'
+]
+
+# Низкокардинальные категориальные колонки в hits
+HITS_CATEGORIES = [
+    'event_category',
+    'event_action'
+]
+
+# Схема датасетов: типы колонок при чтении (SMALLINT в БД -> Int16), колонки с датами и форматы их разбора
+SCHEMA = {
+    'sessions': {
+        'dtypes': {
+            'session_id': 'str',
+            'client_id': 'str',
+            'visit_time': 'str',
+            'visit_number': 'Int16',
+            **{col: 'category' for col in SESSIONS_CATEGORIES}
+        },
+        'dates': ['visit_date'],
+        # Фиксированные форматы дат/времени и признак обязательности (NOT NULL в БД)
+        'formats': {
+            'visit_date': ('%Y-%m-%d', False),
+            'visit_time': ('%H:%M:%S', True)
+        }
+    },
+    'hits': {
+        'dtypes': {
+            'session_id': 'str',
+            'hit_number': 'Int16',
+            'hit_page_path': 'str',
+            **{col: 'category' for col in HITS_CATEGORIES}
+        },
+        'dates': ['hit_date'],
+        'formats': {
+            'hit_date': ('%Y-%m-%d', True)
+        }
+    }
+}
+
+# Спецификация обработки датасетов (применяется за один проход по колонкам): колонки с процентом пропущенных
+# значений более 20 и неинформативные колонки, заполнение пропусков категориальных признаков, обязательные колонки
+# (строки с пропусками удаляются) и целевые типы
+TRANSFORMS = {
+    'sessions': {
+        'drop': ['device_model', 'utm_keyword', 'device_os'],
+        'fill': {col: 'other' for col in SESSIONS_CATEGORIES},
+        'required': ['visit_number', 'visit_time', 'visit_date', 'session_id', 'client_id'],
+        'types': {'visit_number': 'int16'}
+    },
+    'hits': {
+        'drop': ['event_value', 'hit_time', 'hit_referer', 'event_label', 'hit_type'],
+        'fill': {col: 'other' for col in ['hit_page_path'] + HITS_CATEGORIES},
+        'required': ['hit_date', 'hit_number', 'session_id'],
+        'types': {'hit_number': 'int16'}
+    }
+}
+
+
+def dataset_of(
+        file_path: str
+) -> str:
+    """
+    Функция определения типа датасета (sessions/hits) по имени файла
+    """
+
+    return 'sessions' if 'session' in file_path.split('/')[-1] else 'hits'
+
+
+def read_csv_kwargs(
+        dataset: str
+) -> Dict:
+    """
+    Функция формирования параметров pandas.read_csv согласно схеме датасета
+    """
+
+    return {
+        'dtype': SCHEMA[dataset]['dtypes'],
+        'parse_dates': SCHEMA[dataset]['dates']
+    }
+
+
+def apply_schema(
+        df: pd.DataFrame,
+        dataset: str
+) -> pd.DataFrame:
+    """
+    Функция приведения колонок датафрейма, собранного не из csv (json), к типам схемы датасета
+    """
+
+    for col, dtype in SCHEMA[dataset]['dtypes'].items():
+        if col not in df.columns:
+            continue
+        if dtype == 'str':
+            # Приведение к строке без превращения пропусков в 'nan'/'None'
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+        elif dtype == 'Int16':
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype(dtype)
+        else:
+            df[col] = df[col].astype(dtype)
+    # Даты разбираются векторно при приведении типов с отбором некорректных значений
+    return df
+
+
+# Таблицы БД: первичный ключ, родительская таблица (связь hits -> sessions) и колонка секционирования
+TABLES = {
+    'db_sessions': {
+        'key': ['session_id'],
+        'parent': None,
+        'partition': 'visit_date'
+    },
+    'db_hits': {
+        'key': ['session_id', 'hit_number'],
+        'parent': ('db_sessions', 'session_id'),
+        'partition': 'hit_date'
+    }
+}
+
+# Ограничения колонок в БД для проверки выгрузок перед загрузкой: максимальная длина строк (VARCHAR(50))
+# и диапазон значений (SMALLINT)
+VARCHAR_LEN = 50
+SMALLINT_RANGE = (-32768, 32767)
+COLUMN_LIMITS = {
+    'sessions': {
+        'session_id': {'max_len': VARCHAR_LEN},
+        'client_id': {'max_len': VARCHAR_LEN},
+        'visit_number': {'range': SMALLINT_RANGE},
+        **{col: {'max_len': VARCHAR_LEN} for col in SESSIONS_CATEGORIES}
+    },
+    'hits': {
+        'session_id': {'max_len': VARCHAR_LEN},
+        'hit_number': {'range': SMALLINT_RANGE},
+        **{col: {'max_len': VARCHAR_LEN} for col in HITS_CATEGORIES}
+    }
+}